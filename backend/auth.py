@@ -1,21 +1,86 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Any
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from models import User, TokenData
 from config import settings
 from database import get_database
+from services.password_hasher import password_hasher
+import threading
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+class PrincipalCache:
+    """In-process TTL/LRU cache of resolved users keyed by token subject (email).
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    Saves the users lookup that would otherwise run on every authenticated
+    request. Entries are dropped when the profile or password changes.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, subject: str) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, subject: str, user: User):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl_seconds, user)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def invalidate_user_id(self, user_id: str):
+        with self._lock:
+            for subject in [s for s, (_, user) in self._entries.items() if user.id == str(user_id)]:
+                del self._entries[subject]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+principal_cache = PrincipalCache(settings.principal_cache_ttl_seconds, settings.principal_cache_max_entries)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -27,6 +92,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
+def token_claims(user: User) -> Dict[str, Any]:
+    """Claims put into access tokens; enough for claims-only authentication"""
+    return {"sub": user.email, "uid": str(user.id), "username": user.username, "name": user.name}
+
 async def get_user_by_email(email: str):
     db = await get_database()
     user = await db.users.find_one({"email": email})
@@ -38,11 +107,11 @@ async def authenticate_user(email: str, password: str):
     user = await get_user_by_email(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def _decode_token(credentials: HTTPAuthorizationCredentials) -> Dict[str, Any]:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -50,14 +119,52 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     )
     try:
         payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
-        email: str = payload.get("sub")
-        if email is None:
+        if payload.get("sub") is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = await get_user_by_email(email=token_data.email)
+    return payload
+
+async def resolve_user(email: str) -> Optional[User]:
+    """Look up the user for a token subject, going through the principal cache"""
+    user = principal_cache.get(email)
     if user is None:
-        raise credentials_exception
+        user = await get_user_by_email(email=email)
+        if user is not None:
+            principal_cache.put(email, user)
+    return user
+
+async def get_current_user_from_db(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Current user as stored, for endpoints that return profile data"""
+    payload = _decode_token(credentials)
+    user = await resolve_user(payload["sub"])
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = _decode_token(credentials)
+    if settings.auth_claims_only and payload.get("uid"):
+        # Trust the signed claims instead of looking the user up; profile
+        # fields may be stale until the token is refreshed
+        return User(
+            _id=payload["uid"],
+            email=payload["sub"],
+            username=payload.get("username") or "",
+            name=payload.get("name"),
+            hashed_password="",
+        )
+    return await get_current_user_from_db(credentials)
+
+async def get_websocket_user(token: Optional[str]) -> Optional[User]:
+    """User for a WebSocket handshake token, or None when it is missing or invalid"""
+    if not token:
+        return None
+    try:
+        return await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        return None
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Compare request throughput under the old log_requests middleware and the access log middleware
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+import structlog
+from fastapi import FastAPI, Request
+
+from services.access_log import AccessLogMiddleware, AccessLogWriter
+
+PAYLOAD = [{"_id": f"{i:024x}", "title": f"Activity {i}", "cost": 12.5} for i in range(50)]
+
+
+def build_app(variant, sample_rate):
+    app = FastAPI()
+
+    @app.get("/trips/{trip_id}/activities")
+    async def activities(trip_id: str):
+        return PAYLOAD
+
+    writer = None
+    if variant == "log_requests":
+        # The previous middleware: two synchronous structlog calls per request
+        # on top of the buffering @app.middleware("http") wrapper
+        logger = structlog.get_logger()
+
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            logger.info("request_start", method=request.method, url=str(request.url))
+            response = await call_next(request)
+            logger.info("request_end", status_code=response.status_code)
+            return response
+    elif variant == "access_log":
+        writer = AccessLogWriter(max_queued=10000, structured=True)
+        app.add_middleware(AccessLogMiddleware, writer=writer, sample_rate=sample_rate)
+    return app, writer
+
+
+async def drive(app, requests, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = iter(range(requests))
+
+        async def worker():
+            for i in remaining:
+                await client.get(f"/trips/{i % 100:024x}/activities")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def main():
+    """Serve the same requests in-process with each logging variant"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="success sampling for the sampled run")
+    args = parser.parse_args()
+
+    # Log lines go to /dev/null so the comparison measures the request path, not the terminal
+    devnull = open(os.devnull, "w")
+    structlog.configure(
+        processors=[structlog.processors.JSONRenderer()],
+        logger_factory=structlog.PrintLoggerFactory(file=devnull),
+    )
+    sys.stdout = devnull
+    logging.getLogger("uvicorn").addHandler(logging.StreamHandler(devnull))
+
+    rows = []
+    for variant, sample_rate in (("none", 1.0), ("log_requests", 1.0), ("access_log", 1.0),
+                                 ("access_log", args.sample_rate)):
+        app, writer = build_app(variant, sample_rate)
+        asyncio.run(drive(app, 200, args.concurrency))  # warm up
+        elapsed = asyncio.run(drive(app, args.requests, args.concurrency))
+        if writer:
+            writer.shutdown()
+        label = variant if sample_rate >= 1 else f"{variant} @{sample_rate:g}"
+        rows.append((label, args.requests / elapsed, elapsed / args.requests * 1e6))
+
+    sys.stdout = sys.__stdout__
+    print(f"{'middleware':>20}{'req/s':>10}{'us/req':>10}")
+    for label, throughput, per_request in rows:
+        print(f"{label:>20}{throughput:>10.0f}{per_request:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
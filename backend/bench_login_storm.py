@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Measure latency of an unrelated endpoint while a login storm is hashing passwords
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from services.password_hasher import PasswordHasher, pwd_context
+
+
+def build_app(hasher, stored_hash):
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {"message": "TravelMate API is running!"}
+
+    @app.post("/login-inline")
+    async def login_inline():
+        # What /auth/login did before hashing moved off the event loop
+        return {"ok": pwd_context.verify("benchmark-password", stored_hash)}
+
+    @app.post("/login")
+    async def login():
+        return {"ok": await hasher.verify("benchmark-password", stored_hash)}
+
+    return app
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def run(app, login_path, logins, concurrency, probe_interval):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = logins
+        latencies = []
+
+        async def storm_worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await client.post(login_path)
+
+        async def probe():
+            while remaining > 0:
+                start = time.perf_counter()
+                await client.get("/")
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(probe_interval)
+
+        start = time.perf_counter()
+        await asyncio.gather(probe(), *(storm_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "probes": len(latencies),
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": percentile(latencies, 0.99) if latencies else 0.0,
+        "max": max(latencies) if latencies else 0.0,
+    }
+
+
+def main():
+    """Run the same storm with hashing inline and on the worker pool"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=64, help="login requests in the storm")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent login clients")
+    parser.add_argument("--workers", type=int, default=4, help="password hashing workers")
+    parser.add_argument("--probe-interval", type=float, default=0.005, help="seconds between probes of /")
+    args = parser.parse_args()
+
+    stored_hash = pwd_context.hash("benchmark-password")
+    hasher = PasswordHasher(workers=args.workers, max_pending=args.logins)
+    app = build_app(hasher, stored_hash)
+
+    print(f"{args.logins} logins, {args.concurrency} concurrent, {args.workers} hashing workers")
+    print(f"{'mode':<10}{'elapsed s':>10}{'probes':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    try:
+        for mode, path in (("inline", "/login-inline"), ("executor", "/login")):
+            result = asyncio.run(run(app, path, args.logins, args.concurrency, args.probe_interval))
+            print(f"{mode:<10}{result['elapsed']:>10.2f}{result['probes']:>8}"
+                  f"{result['p50']:>10.1f}{result['p99']:>10.1f}{result['max']:>10.1f}")
+    finally:
+        hasher.shutdown()
+
+    stats = hasher.stats()
+    print(f"executor hash latency incl. queueing: p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
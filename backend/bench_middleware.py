@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Measure the per-request overhead of each middleware in the API stack
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.middleware.trustedhost import TrustedHostMiddleware
+
+from services.access_log import AccessLogMiddleware, AccessLogWriter
+from services.metrics import MetricsMiddleware
+from services.middleware import PathPrefixMiddleware
+
+SECRET = "bench-secret"
+BODY = b'{"message": "ok"}'
+
+
+async def endpoint(scope, receive, send):
+    # Stand-in for a routed handler: what the router adds to the scope, then a small JSON body
+    scope["path_params"] = {}
+    scope["endpoint"] = endpoint
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(BODY)).encode())]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+async def passthrough(request, call_next):
+    return await call_next(request)
+
+
+def make_scope(path, cookie=None, origin=None):
+    headers = [(b"host", b"localhost"), (b"accept", b"application/json")]
+    if cookie:
+        headers.append((b"cookie", cookie))
+    if origin:
+        headers.append((b"origin", origin))
+    return {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": path,
+            "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("localhost", 8000)}
+
+
+async def session_cookie():
+    """A valid signed session cookie as the OAuth flow would leave it"""
+    cookie = None
+
+    async def app(scope, receive, send):
+        scope["session"]["oauth_state"] = "x" * 43
+        await endpoint(scope, receive, send)
+
+    async def send(message):
+        nonlocal cookie
+        for name, value in message.get("headers", []):
+            if name == b"set-cookie":
+                cookie = value.split(b";")[0]
+
+    await SessionMiddleware(app, secret_key=SECRET, session_cookie="travelmate_session")(
+        make_scope("/"), receive, send)
+    return cookie
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def measure(app, scope, requests):
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    """Time the bare endpoint, then each middleware alone and the old and new stacks"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    sys.stdout = open(os.devnull, "w")
+    cookie = asyncio.run(session_cookie())
+    writer = AccessLogWriter(max_queued=100000, structured=True)
+    api = make_scope("/trips/", cookie=cookie)
+    cors = make_scope("/trips/", cookie=cookie, origin=b"http://localhost:3000")
+    oauth = make_scope("/auth/oauth/google/callback", cookie=cookie)
+
+    def session(app):
+        return SessionMiddleware(app, secret_key=SECRET, session_cookie="travelmate_session")
+
+    def scoped_session(app):
+        return PathPrefixMiddleware(app, prefix="/auth/oauth", middleware_class=SessionMiddleware,
+                                    secret_key=SECRET, session_cookie="travelmate_session")
+
+    def trusted(app):
+        return TrustedHostMiddleware(app, allowed_hosts=["localhost", "127.0.0.1"])
+
+    def cors_mw(app):
+        return CORSMiddleware(app, allow_origins=["http://localhost:3000"], allow_credentials=True,
+                              allow_methods=["*"], allow_headers=["*"])
+
+    def old_stack(app):
+        return BaseHTTPMiddleware(session(trusted(cors_mw(app))), dispatch=passthrough)
+
+    def new_stack(app):
+        return AccessLogMiddleware(MetricsMiddleware(trusted(cors_mw(scoped_session(app)))), writer=writer)
+
+    cases = [
+        ("bare endpoint", endpoint, api),
+        ("BaseHTTPMiddleware", BaseHTTPMiddleware(endpoint, dispatch=passthrough), api),
+        ("TrustedHost", trusted(endpoint), api),
+        ("CORS, no Origin", cors_mw(endpoint), api),
+        ("CORS, with Origin", cors_mw(endpoint), cors),
+        ("Session, every path", session(endpoint), api),
+        ("Session, scoped: API", scoped_session(endpoint), api),
+        ("Session, scoped: OAuth", scoped_session(endpoint), oauth),
+        ("Metrics", MetricsMiddleware(endpoint), api),
+        ("AccessLog", AccessLogMiddleware(endpoint, writer=writer), api),
+        ("old stack", old_stack(endpoint), api),
+        ("new stack", new_stack(endpoint), api),
+    ]
+
+    async def run_all():
+        return [(name, await measure(app, scope, args.requests)) for name, app, scope in cases]
+
+    results = asyncio.run(run_all())
+    writer.shutdown()
+    sys.stdout = sys.__stdout__
+    bare = results[0][1]
+    print(f"{'middleware':>24}{'us/req':>10}{'overhead us':>13}")
+    for name, per_request in results:
+        print(f"{name:>24}{per_request:>10.2f}{per_request - bare:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
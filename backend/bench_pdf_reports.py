@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure PDF trip report rendering for trips with 10, 100 and 1000 activities
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from services.export_service import PdfReportCache, render_trip_pdf
+
+CATEGORIES = ["accommodation", "food", "transport", "entertainment"]
+
+
+def build_trip(activity_count):
+    start = datetime(2025, 6, 1)
+    days = max(1, activity_count // 8)
+    return {
+        "_id": ObjectId(),
+        "title": f"Benchmark trip {activity_count}",
+        "destination": "Lisbon",
+        "start_date": start,
+        "end_date": start + timedelta(days=days),
+        "budget": 5000.0,
+        "owner_id": ObjectId(),
+        "activities": [
+            {
+                "_id": ObjectId(),
+                "title": f"Activity {i}",
+                "time": f"{8 + i % 12:02d}:00",
+                "location": "Somewhere in town",
+                "activity_type": "activity",
+                "cost": 12.5,
+                "day": 1 + i % days,
+            }
+            for i in range(activity_count)
+        ],
+        "expenses": [
+            {
+                "_id": ObjectId(),
+                "title": f"Expense {i}",
+                "amount": 20.0,
+                "category": CATEGORIES[i % len(CATEGORIES)],
+                "date": start + timedelta(hours=i),
+            }
+            for i in range(activity_count // 2)
+        ],
+        "updated_at": start,
+    }
+
+
+async def run(cache, trip, loop_probe_interval):
+    """Render through the pool and measure the event loop's worst stall meanwhile"""
+    stall = 0.0
+    done = False
+
+    async def probe():
+        nonlocal stall
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(loop_probe_interval)
+            stall = max(stall, time.perf_counter() - start - loop_probe_interval)
+
+    probe_task = asyncio.create_task(probe())
+    key = cache.key(str(trip["_id"]), trip["updated_at"])
+    start = time.perf_counter()
+    await cache.render(key, trip)
+    pooled = time.perf_counter() - start
+    done = True
+    await probe_task
+
+    start = time.perf_counter()
+    cache.get(key)
+    cached = time.perf_counter() - start
+    return pooled, stall, cached
+
+
+def main():
+    """Render each trip size inline, through the process pool, and from cache"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="activities per trip")
+    parser.add_argument("--workers", type=int, default=2, help="render processes")
+    args = parser.parse_args()
+
+    cache = PdfReportCache(workers=args.workers, max_bytes=256 * 1024 * 1024)
+    print(f"{'activities':>10}{'size KB':>10}{'inline ms':>12}{'pool ms':>10}{'loop stall ms':>15}{'cached ms':>11}")
+    try:
+        for size in args.sizes:
+            trip = build_trip(size)
+            start = time.perf_counter()
+            report = render_trip_pdf(trip)
+            inline = time.perf_counter() - start
+            pooled, stall, cached = asyncio.run(run(cache, trip, 0.001))
+            print(f"{size:>10}{len(report) / 1024:>10.1f}{inline * 1000:>12.1f}{pooled * 1000:>10.1f}"
+                  f"{stall * 1000:>15.1f}{cached * 1000:>11.3f}")
+    finally:
+        cache.shutdown()
+
+
+if __name__ == '__main__':
+    main()
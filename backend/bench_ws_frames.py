@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Measure frames and bytes per collaborative edit on the trip WebSocket
+"""
+import argparse
+import asyncio
+import zlib
+
+from bson import ObjectId
+
+from config import settings
+from models import PackingItem, Activity
+from services.connection_manager import ConnectionManager, MSGPACK_SUBPROTOCOL
+from services.backplane import InMemoryBackplane
+from services.trip_events import event_message, item_payload
+
+
+class CountingSocket:
+    """Stands in for a client socket and counts what would go on the wire"""
+
+    def __init__(self, subprotocol, deflate):
+        self.scope = {"subprotocols": [subprotocol] if subprotocol else []}
+        # permessage-deflate keeps one compression context per connection
+        self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS) if deflate else None
+        self.frames = 0
+        self.bytes = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        self._count(data.encode())
+
+    async def send_bytes(self, data):
+        self._count(data)
+
+    def _count(self, payload):
+        if self.compressor:
+            # RFC 7692: flush each message and drop the trailing 00 00 ff ff
+            payload = (self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        self.frames += 1
+        self.bytes += len(payload) + (2 if len(payload) < 126 else 4)
+
+
+def build_edits(trip_id, items, toggles):
+    """A packing session: items added one by one, then rapid toggling, plus an activity edit"""
+    packing = [{"_id": ObjectId(), "name": f"Item {i}", "category": "clothes", "packed": False, "notes": ""}
+               for i in range(items)]
+    activity = {"_id": ObjectId(), "title": "Museum", "time": "10:00", "location": "Old town",
+                "activity_type": "activity", "notes": "", "cost": 12.5, "day": 1, "order": 0}
+    edits = [event_message(trip_id, "packing_items.added", items=[item_payload(PackingItem, item)])
+             for item in packing]
+    for i in range(toggles):
+        item = packing[i % max(1, items // 4)]
+        item["packed"] = not item["packed"]
+        edits.append(event_message(trip_id, "packing_items.updated", item=item_payload(PackingItem, item)))
+    for minute in range(5):
+        activity["time"] = f"10:{minute * 10:02d}"
+        edits.append(event_message(trip_id, "activities.updated", item=item_payload(Activity, activity)))
+    return edits
+
+
+async def run(edits, trip_id, subprotocol, deflate, window_ms, gap):
+    settings.ws_coalesce_window_ms = window_ms
+    manager = ConnectionManager()
+    await manager.start(InMemoryBackplane())
+    # Let the channel see a message first so the only control frame is the greeting
+    await manager.broadcast_to_trip(edits[0], trip_id)
+    await asyncio.sleep(window_ms / 1000 + 0.01)
+    socket = CountingSocket(subprotocol, deflate)
+    connection = await manager.connect(socket, trip_id)
+    for message in edits:
+        await manager.broadcast_to_trip(message, trip_id)
+        await asyncio.sleep(gap)
+    await asyncio.sleep(window_ms / 1000 + 0.05)
+    while not connection.queue.empty():
+        await asyncio.sleep(0.01)
+    await manager.stop()
+    # The first frame is the channel.ready greeting
+    return socket.frames - 1, socket.bytes, manager.coalesced
+
+
+def main():
+    """Replay the same edit burst with each framing, compression and coalescing option"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=20, help="packing items added")
+    parser.add_argument("--toggles", type=int, default=60, help="packed/unpacked toggles")
+    parser.add_argument("--gap-ms", type=float, default=5.0, help="time between edits")
+    parser.add_argument("--window-ms", type=int, default=50, help="coalescing window to compare")
+    args = parser.parse_args()
+
+    trip_id = str(ObjectId())
+    edits = build_edits(trip_id, args.items, args.toggles)
+    print(f"{len(edits)} edits, {sum(len(e) for e in edits)} bytes of JSON published")
+    print(f"{'framing':>9}{'deflate':>9}{'window ms':>11}{'frames':>8}{'bytes':>9}{'bytes/edit':>12}{'coalesced':>11}")
+    for subprotocol in (None, MSGPACK_SUBPROTOCOL):
+        for deflate in (False, True):
+            for window_ms in (0, args.window_ms):
+                frames, total, coalesced = asyncio.run(
+                    run(edits, trip_id, subprotocol, deflate, window_ms, args.gap_ms / 1000)
+                )
+                framing = "msgpack" if subprotocol else "json"
+                print(f"{framing:>9}{'on' if deflate else 'off':>9}{window_ms:>11}{frames:>8}{total:>9}"
+                      f"{total / len(edits):>12.1f}{coalesced:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,19 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
 
+    # Authenticated user resolution
+    principal_cache_ttl_seconds: int = 60  # 0 disables the cache
+    principal_cache_max_entries: int = 10000
+    auth_claims_only: bool = False  # trust uid/username claims without a users lookup
+
+    # Password hashing runs on a bounded worker pool off the event loop
+    password_hash_workers: int = 4
+    password_hash_max_pending: int = 64  # running plus queued; beyond this logins get 503
+
+    # Database index settings
+    ensure_indexes_on_startup: bool = True
+    index_coverage_mode: str = "warn"  # off, warn or fail
+
     # Security settings
     enable_rate_limiting: bool = True
     rate_limit_requests: int = 100
@@ -19,9 +32,57 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     enable_structured_logging: bool = True
 
+    # Real-time trip channel; "unix" or "mongo" fan out across worker processes
+    realtime_backplane: str = "memory"  # memory, unix or mongo
+    realtime_socket_path: str = "/tmp/travelmate-backplane.sock"
+    realtime_events_collection: str = "trip_events"
+    realtime_events_size_bytes: int = 16 * 1024 * 1024
+    ws_send_queue_size: int = 256  # per connection; overflowing clients are evicted
+    ws_send_timeout_seconds: float = 10.0
+    ws_replay_buffer_size: int = 128  # messages kept per trip for resuming clients
+    ws_replay_max_trips: int = 1000
+    ws_coalesce_window_ms: int = 50  # 0 sends every message immediately
+    ws_per_message_deflate: bool = True
+    ws_max_message_bytes: int = 1048576  # larger client frames close the socket
+    ws_ping_interval_seconds: float = 20.0
+    ws_idle_timeout_seconds: float = 60.0  # close sockets silent for this long
+    ws_max_connections_per_trip: int = 50
+    ws_max_connections: int = 5000  # per worker
+    # Prometheus metrics at /metrics, per worker process
+    metrics_enabled: bool = True
+    # Per-command MongoDB timings, and a log of commands slower than the threshold
+    mongo_command_monitoring: bool = True
+    mongo_slow_query_ms: float = 100.0
+    mongo_reply_size_sample_rate: float = 0.01  # slow commands are always measured
+    # Access log; responses below 400 are sampled, errors are always logged
+    access_log_enabled: bool = True
+    access_log_sample_rate: float = 1.0
+    access_log_queue_size: int = 10000
+    # Per-request profiling and tracemalloc endpoints, both disabled while the secret is empty
+    profiling_secret: str = ""
+    profiling_output_dir: str = "/tmp/travelmate-profiles"
+    profiling_max_files: int = 50  # oldest profiles are deleted past this; 0 keeps only the latest
+    profiling_sample_interval_ms: float = 5.0
+    profiling_max_snapshots: int = 10
+
+    # Change feed for delta sync
+    change_log_retention_days: int = 30  # older cursors get 410 and must reload in full
+    change_feed_settle_seconds: float = 2.0  # entries younger than this are held back
+
+    # Weather provider
+    weather_timeout_seconds: float = 10.0
+    weather_forecast_ttl_seconds: int = 600
+    weather_forecast_stale_seconds: int = 3600  # past the TTL, serve stale while refreshing
+    weather_cache_max_entries: int = 5000
+
+    # Batch create endpoints
+    max_batch_size: int = 100
+
     # Export settings
     enable_pdf_export: bool = True
     enable_calendar_export: bool = True
+    pdf_render_workers: int = 2  # processes; reportlab holds the GIL while rendering
+    pdf_cache_max_bytes: int = 64 * 1024 * 1024
 
     # OAuth settings
     google_client_id: str = ""
@@ -1,5 +1,8 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from config import settings
+from indexes import bootstrap_indexes
+from services.metrics import MongoPoolListener
+from services.mongo_monitoring import MongoCommandListener
 import logging
 import certifi
 
@@ -14,12 +17,16 @@ async def get_database():
 
 async def connect_to_mongo():
     """Create database connection"""
+    listeners = [MongoPoolListener()]
+    if settings.mongo_command_monitoring:
+        listeners.append(MongoCommandListener())
     try:
         db.client = AsyncIOMotorClient(
             settings.mongodb_url,
             tls=True,
             tlsCAFile=certifi.where(),
             serverSelectionTimeoutMS=30000,
+            event_listeners=listeners,
         )
         db.database = db.client.vacation_planner
         logging.info("Connected to MongoDB")
@@ -27,6 +34,8 @@ async def connect_to_mongo():
         logging.error(f"Failed to connect to MongoDB: {e}")
         raise
 
+    await bootstrap_indexes(db.database)
+
 async def close_mongo_connection():
     """Close database connection"""
     if db.client:
@@ -0,0 +1,171 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from bson import ObjectId
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Placeholder values used when explaining hot queries; only the plan matters.
+_PROBE_ID = "000000000000000000000000"
+
+# Declared indexes per collection. Every query pattern that runs on a request
+# path should be served by one of these.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "trips": [
+        # GET /trips/ and /trips/summary run an $or over these two clauses
+        # sorted by created_at, with _id as the pagination tie-breaker
+        IndexModel(
+            [("owner_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="owner_created_id",
+        ),
+        IndexModel(
+            [("collaborators", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="collaborators_created_id",
+        ),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "trip_changes": [
+        # GET /trips/changes: entries for the user's trips, and trip tombstones
+        IndexModel([("trip_id", ASCENDING), ("_id", ASCENDING)], name="trip_id_order"),
+        IndexModel([("audience", ASCENDING), ("_id", ASCENDING)], name="audience_id_order"),
+        IndexModel(
+            [("at", ASCENDING)],
+            name="at_ttl",
+            expireAfterSeconds=settings.change_log_retention_days * 24 * 3600,
+        ),
+    ],
+    "password_resets": [
+        IndexModel([("token", ASCENDING)], name="token"),
+        # Expired reset requests are removed by the server once expires_at passes
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+# Indexes superseded by a declaration above; dropped on startup if present
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "trips": ["owner_created", "collaborators_created"],
+    "trip_changes": ["seq_unique", "trip_seq", "audience_seq"],
+}
+
+
+@dataclass
+class HotQuery:
+    """A query on a request path that must never fall back to a collection scan"""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = field(default=None)
+
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery(
+        "trips.list_for_user",
+        "trips",
+        {"$or": [{"owner_id": _PROBE_ID}, {"collaborators": _PROBE_ID}]},
+        sort=[("created_at", DESCENDING)],
+    ),
+    HotQuery(
+        "trips.summary_page",
+        "trips",
+        {"$and": [
+            {"$or": [{"owner_id": _PROBE_ID}, {"collaborators": _PROBE_ID}]},
+            {"$or": [
+                {"created_at": {"$lt": datetime(1970, 1, 1)}},
+                {"created_at": datetime(1970, 1, 1), "_id": {"$lt": ObjectId(_PROBE_ID)}},
+            ]},
+        ]},
+        sort=[("created_at", DESCENDING), ("_id", DESCENDING)],
+    ),
+    HotQuery(
+        "trip_changes.since",
+        "trip_changes",
+        {
+            "_id": {"$gt": ObjectId(_PROBE_ID)},
+            "$or": [{"trip_id": {"$in": [ObjectId(_PROBE_ID)]}}, {"audience": _PROBE_ID}],
+        },
+        sort=[("_id", ASCENDING)],
+    ),
+    HotQuery("users.by_email", "users", {"email": "probe@example.com"}),
+    HotQuery(
+        "password_resets.by_token",
+        "password_resets",
+        {"token": "probe", "expires_at": {"$gt": datetime(1970, 1, 1)}},
+    ),
+]
+
+
+class IndexCoverageError(RuntimeError):
+    """Raised when a hot query is not covered by an index and the mode is 'fail'"""
+
+
+async def ensure_indexes(database) -> None:
+    """Create every declared index; existing indexes with the same spec are a no-op"""
+    for collection, names in RETIRED_INDEXES.items():
+        existing = await database[collection].index_information()
+        for name in names:
+            if name in existing:
+                await database[collection].drop_index(name)
+                logger.info("Dropped retired index %s.%s", collection, name)
+
+    for collection, models in INDEXES.items():
+        names = await database[collection].create_indexes(models)
+        logger.info("Ensured indexes on %s: %s", collection, ", ".join(names))
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Collect every stage name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def find_uncovered_queries(database) -> List[str]:
+    """Explain each hot query and return the names of those planned as a COLLSCAN"""
+    uncovered = []
+    for query in HOT_QUERIES:
+        cursor = database[query.collection].find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explain = await cursor.explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            uncovered.append(query.name)
+    return uncovered
+
+
+async def check_index_coverage(database) -> None:
+    """Warn about or refuse to start with hot queries that would scan a collection"""
+    mode = settings.index_coverage_mode
+    if mode == "off":
+        return
+
+    uncovered = await find_uncovered_queries(database)
+    if not uncovered:
+        logger.info("All %d hot queries are covered by indexes", len(HOT_QUERIES))
+        return
+
+    message = f"Hot queries not covered by an index: {', '.join(uncovered)}"
+    if mode == "fail":
+        raise IndexCoverageError(message)
+    logger.warning(message)
+
+
+async def bootstrap_indexes(database) -> None:
+    """Create declared indexes and verify hot query coverage on startup"""
+    if not settings.ensure_indexes_on_startup:
+        return
+    await ensure_indexes(database)
+    await check_index_coverage(database)
@@ -1,18 +1,28 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
 from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from starlette.middleware import Middleware
 from starlette.middleware.sessions import SessionMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from contextlib import asynccontextmanager
-import json
-import logging
-import structlog
-from typing import List, Dict, Any
+from typing import Optional
+from bson import ObjectId
 
 from database import connect_to_mongo, close_mongo_connection, get_database
+from services.password_hasher import password_hasher
+from services.weather_service import weather_service
+from services.export_service import pdf_reports
+from services.connection_manager import manager, is_pong, CAPACITY_CLOSE_CODE
+from services.backplane import create_backplane
+from services.access_log import AccessLogMiddleware, access_log
+from services.middleware import PathPrefixMiddleware
+from services.profiling import ProfilingMiddleware, memory_snapshots
+from services.metrics import MetricsMiddleware, stats_collector, render as render_metrics, CONTENT_TYPE_LATEST
+from services.trip_store import TripStore
+from services.expense_service import ExpenseService
 from models import *
 from auth import *
 from routers.auth_router import router as auth_router
@@ -22,124 +32,149 @@ from routers.activities_router import router as activities_router
 from routers.expenses_router import router as expenses_router
 from routers.packing_router import router as packing_router
 from routers.weather_router import router as weather_router
+from routers.admin_router import router as admin_router
 from config import settings
 
-# Configure structured logging
-if settings.enable_structured_logging:
-    structlog.configure(
-        processors=[
-            structlog.processors.JSONRenderer()
-        ]
-    )
-    logger = structlog.get_logger()
-else:
-    logger = logging.getLogger("uvicorn")
+OAUTH_PREFIX = "/auth/oauth"
 
 # Rate limiter setup
 limiter = Limiter(key_func=get_remote_address, default_limits=[f"{settings.rate_limit_requests}/{settings.rate_limit_window} second"])
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, trip_id: str):
-        await websocket.accept()
-        if trip_id not in self.active_connections:
-            self.active_connections[trip_id] = []
-        self.active_connections[trip_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, trip_id: str):
-        if trip_id in self.active_connections:
-            self.active_connections[trip_id].remove(websocket)
-            if not self.active_connections[trip_id]:
-                del self.active_connections[trip_id]
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast_to_trip(self, message: str, trip_id: str):
-        if trip_id in self.active_connections:
-            for connection in self.active_connections[trip_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    # Remove broken connections
-                    self.active_connections[trip_id].remove(connection)
-
-manager = ConnectionManager()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await connect_to_mongo()
+    db = await get_database()
+    # Trips from before materialized totals get them before any expense write
+    await ExpenseService(db).backfill_totals()
+    await manager.start(create_backplane(db))
     yield
     # Shutdown
+    await manager.stop()
     await close_mongo_connection()
-
-app = FastAPI(title="TravelMate API", lifespan=lifespan)
+    password_hasher.shutdown()
+    await weather_service.aclose()
+    pdf_reports.shutdown()
+    access_log.shutdown()
+
+# Service stats exported as gauges on /metrics
+if settings.metrics_enabled:
+    stats_collector.register("password_hasher", password_hasher.stats)
+    stats_collector.register("principal_cache", principal_cache.stats)
+    stats_collector.register("weather", weather_service.stats)
+    stats_collector.register("pdf_reports", pdf_reports.stats)
+    stats_collector.register("websocket", manager.stats)
+    stats_collector.register("access_log", access_log.stats)
+    stats_collector.register("tracemalloc", memory_snapshots.status)
+
+# Middleware stack, outermost first; every layer is plain ASGI, so none of
+# them buffers responses or runs the app in a separate task
+middleware = []
+if settings.access_log_enabled:
+    # Access log, written off the request path; JSON lines with structured logging
+    middleware.append(Middleware(AccessLogMiddleware))
+if settings.metrics_enabled:
+    middleware.append(Middleware(MetricsMiddleware))
+if settings.profiling_secret:
+    # Profiles single requests sent with the secret; absent from the stack otherwise
+    middleware.append(Middleware(ProfilingMiddleware))
+middleware += [
+    # Trusted hosts (optional, can be configured)
+    Middleware(TrustedHostMiddleware, allowed_hosts=["localhost", "127.0.0.1"]),
+    Middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    ),
+    # Only the OAuth flows use request.session, so only they pay for the cookie
+    Middleware(
+        PathPrefixMiddleware,
+        prefix=OAUTH_PREFIX,
+        middleware_class=SessionMiddleware,
+        secret_key=settings.secret_key,
+        session_cookie="travelmate_session",
+        path=OAUTH_PREFIX,
+    ),
+]
+
+app = FastAPI(title="TravelMate API", lifespan=lifespan, middleware=middleware)
 
 # Add rate limiting middleware
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Trusted hosts middleware (optional, can be configured)
-app.add_middleware(
-    TrustedHostMiddleware,
-    allowed_hosts=["localhost", "127.0.0.1"]
-)
-
-# Session middleware for OAuth
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=settings.secret_key,
-    session_cookie="travelmate_session"
-)
-
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["authentication"])
-app.include_router(oauth_router, prefix="/auth/oauth", tags=["oauth"])
+app.include_router(oauth_router, prefix=OAUTH_PREFIX, tags=["oauth"])
 app.include_router(trips_router, prefix="/trips", tags=["trips"])
 app.include_router(activities_router, prefix="/activities", tags=["activities"])
 app.include_router(expenses_router, prefix="/expenses", tags=["expenses"])
 app.include_router(packing_router, prefix="/packing", tags=["packing"])
 app.include_router(weather_router, prefix="/weather", tags=["weather"])
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info("request_start", method=request.method, url=str(request.url))
-    response = await call_next(request)
-    logger.info("request_end", status_code=response.status_code)
-    return response
+app.include_router(admin_router, prefix="/admin", tags=["admin"], include_in_schema=False)
 
 @app.get("/")
 async def root():
     return {"message": "TravelMate API is running!"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/favicon.ico")
 async def favicon():
     return Response(status_code=204)
 
 @app.websocket("/ws/{trip_id}")
-async def websocket_endpoint(websocket: WebSocket, trip_id: str):
-    await manager.connect(websocket, trip_id)
+async def websocket_endpoint(websocket: WebSocket, trip_id: str, token: Optional[str] = None,
+                             last_seq: Optional[int] = None, epoch: Optional[str] = None):
+    # Handshakes from some clients cannot carry headers, so the token may come as ?token=
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    user = await get_websocket_user(token)
+    if user is None or not ObjectId.is_valid(trip_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    try:
+        await TripStore(await get_database()).load(ObjectId(trip_id), user.id, {})
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    if manager.at_capacity(trip_id):
+        # Refused after the handshake so the client sees 1013 and backs off
+        await manager.refuse(websocket, CAPACITY_CLOSE_CODE)
+        return
+    
+    # A reconnecting client passes the last seq/epoch it saw to get what it missed
+    connection = await manager.connect(websocket, trip_id, last_seq, epoch)
     try:
         while True:
             data = await websocket.receive_text()
-            # Broadcast the message to all connected clients for this trip
-            await manager.broadcast_to_trip(data, trip_id)
+            connection.touch()
+            if is_pong(data):
+                continue
+            # Relay to everyone on the trip, marked as coming from this user
+            await manager.relay(data, trip_id, user.id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, trip_id)
+        pass
+    finally:
+        # Also runs when the socket errors out or the task is cancelled
+        manager.remove(connection)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.host, port=settings.port)
+    uvicorn.run(
+        app, host=settings.host, port=settings.port,
+        ws_per_message_deflate=settings.ws_per_message_deflate,
+        ws_max_size=settings.ws_max_message_bytes,
+        ws_ping_interval=settings.ws_ping_interval_seconds,
+        ws_ping_timeout=settings.ws_idle_timeout_seconds,
+    )
@@ -81,6 +81,11 @@ class Activity(BaseModel):
     def serialize_id(self, v):
         return str(v)
 
+class ActivityMove(BaseModel):
+    activity_id: str
+    position: int = Field(ge=0)  # zero-based position within the day
+    day: Optional[int] = Field(default=None, ge=1)  # move to another day
+
 class Expense(BaseModel):
     id: PyObjectId = Field(default_factory=lambda: str(ObjectId()), alias="_id")
     title: str
@@ -129,6 +134,11 @@ class Trip(BaseModel):
     expenses: List[Expense] = []
     packing_items: List[PackingItem] = []
     notes: Optional[str] = ""
+    # Running expense totals, maintained by the expense endpoints
+    total_spent: float = 0.0
+    category_totals: Dict[str, float] = {}
+    # Bumped by every write to the trip or its items; keys ETags
+    version: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -150,6 +160,76 @@ class Trip(BaseModel):
     def serialize_collaborators(self, v):
         return [str(x) for x in v]
 
+class TripSummary(BaseModel):
+    """Compact trip listing entry without the embedded item arrays"""
+    id: PyObjectId = Field(alias="_id")
+    title: str
+    destination: str
+    start_date: datetime
+    end_date: datetime
+    budget: float
+    owner_id: PyObjectId
+    status: str  # upcoming, ongoing, completed
+    collaborator_count: int = 0
+    activity_count: int = 0
+    expense_count: int = 0
+    packing_count: int = 0
+    packed_count: int = 0
+    total_spent: float = 0.0
+    created_at: datetime
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
+
+    @field_serializer('id')
+    def serialize_id(self, v):
+        return str(v)
+
+    @field_serializer('owner_id')
+    def serialize_owner_id(self, v):
+        return str(v)
+
+class TripSummaryPage(BaseModel):
+    items: List[TripSummary]
+    next_cursor: Optional[str] = None
+
+class TripItemChange(BaseModel):
+    trip_id: str
+    field: str  # activities, expenses, packing_items
+    item: Dict[str, Any]
+
+class TripDeletion(BaseModel):
+    trip_id: str
+    field: Optional[str] = None  # unset when the whole trip was deleted
+    item_id: Optional[str] = None
+
+class BatchItemError(BaseModel):
+    index: int  # position of the rejected item in the request
+    errors: List[Dict[str, Any]]
+
+class ActivityBatchResult(BaseModel):
+    created: List[Activity]
+    errors: List[BatchItemError] = []
+
+class ExpenseBatchResult(BaseModel):
+    created: List[Expense]
+    errors: List[BatchItemError] = []
+
+class PackingItemBatchResult(BaseModel):
+    created: List[PackingItem]
+    errors: List[BatchItemError] = []
+
+class TripChangeFeed(BaseModel):
+    """Changes after a sync cursor: current headers of changed trips, changed items and tombstones"""
+    trips: List[TripSummary] = []
+    items: List[TripItemChange] = []
+    deleted: List[TripDeletion] = []
+    cursor: str
+    has_more: bool = False
+
 class TripCreate(BaseModel):
     title: str
     destination: str
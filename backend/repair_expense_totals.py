@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Recompute the materialized expense totals stored on trip documents
+"""
+import argparse
+import asyncio
+import sys
+from bson import ObjectId
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.expense_service import ExpenseService
+
+
+async def repair(trip_id, dry_run):
+    await connect_to_mongo()
+    try:
+        db = await get_database()
+        return await ExpenseService(db).repair_totals(trip_id, dry_run=dry_run)
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    """Check every trip (or one trip) and rewrite totals that drifted"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trip-id", help="only check this trip")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without writing")
+    args = parser.parse_args()
+
+    trip_id = None
+    if args.trip_id:
+        if not ObjectId.is_valid(args.trip_id):
+            print(f"Invalid trip ID: {args.trip_id}")
+            sys.exit(1)
+        trip_id = ObjectId(args.trip_id)
+
+    result = asyncio.run(repair(trip_id, args.dry_run))
+    action = "would repair" if args.dry_run else "repaired"
+    print(f"Checked {result['checked']} trips, {action} {result['repaired']}")
+
+
+if __name__ == '__main__':
+    main()
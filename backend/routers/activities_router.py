@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from models import Activity, Trip, User
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Header, Response
+from typing import List, Optional, Any
+from models import Activity, ActivityMove, ActivityBatchResult, User
 from auth import get_current_user
 from database import get_database
+from services.trip_store import TripStore, window, validate_batch, touched
+from services.change_log import ChangeLog
+from services.trip_events import publish_trip_event, item_payload
+from services.conditional import VERSION_PROJECTION, trip_version, make_etag, etag_matches, cache_headers, not_modified
+from config import settings
 from bson import ObjectId
 
 router = APIRouter()
 
+# Optimistic reorder retries before giving up with 409
+REORDER_ATTEMPTS = 3
+
+def _day_sequence(activities, day, exclude_id):
+    """IDs of one day's activities in display order, leaving out the one being moved"""
+    items = [(a.get("order", 0), index, a["_id"]) for index, a in enumerate(activities)
+             if a.get("day") == day and a["_id"] != exclude_id]
+    return [activity_id for _, _, activity_id in sorted(items)]
+
 @router.post("/{trip_id}", response_model=Activity)
 async def create_activity(trip_id: str, activity: Activity, current_user: User = Depends(get_current_user)):
     db = await get_database()
@@ -14,45 +28,132 @@ async def create_activity(trip_id: str, activity: Activity, current_user: User =
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Add activity to trip
+    # Add activity to trip; the access check is part of the update filter
     activity_dict = activity.dict()
     activity_dict["_id"] = ObjectId()
     
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$push": {"activities": activity_dict}}
-    )
+    await TripStore(db).push_item(ObjectId(trip_id), current_user.id, "activities", activity_dict)
+    await publish_trip_event(trip_id, "activities.added", items=[item_payload(Activity, activity_dict)])
     
     return Activity(**activity_dict)
 
+@router.post("/{trip_id}/batch", response_model=ActivityBatchResult)
+async def create_activities_batch(
+    trip_id: str,
+    items: List[Any] = Body(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Create several activities in one write; invalid items are reported by index and skipped"""
+    db = await get_database()
+    
+    if not ObjectId.is_valid(trip_id):
+        raise HTTPException(status_code=400, detail="Invalid trip ID")
+    
+    valid, errors = validate_batch(Activity, items, settings.max_batch_size)
+    item_dicts = []
+    for activity in valid:
+        activity_dict = activity.dict()
+        activity_dict["_id"] = ObjectId()
+        item_dicts.append(activity_dict)
+    
+    await TripStore(db).push_items(ObjectId(trip_id), current_user.id, "activities", item_dicts)
+    await publish_trip_event(trip_id, "activities.added", items=[item_payload(Activity, a) for a in item_dicts])
+    
+    return {"created": [Activity(**activity_dict) for activity_dict in item_dicts], "errors": errors}
+
 @router.get("/{trip_id}", response_model=List[Activity])
-async def get_trip_activities(trip_id: str, current_user: User = Depends(get_current_user)):
+async def get_trip_activities(
+    trip_id: str,
+    response: Response,
+    day: Optional[int] = Query(None, ge=1),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     db = await get_database()
     
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
+    # Read only the ACL fields and the requested window of activities
+    cond = {"$eq": ["$$item.day", day]} if day is not None else None
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id,
+        {**VERSION_PROJECTION, "activities": window("activities", cond, skip, limit)}
+    )
     
-    trip_obj = Trip(**trip)
+    etag = make_etag("activities", trip_id, trip_version(trip), day, skip, limit)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+    return [Activity(**activity) for activity in trip.get("activities") or []]
+
+# Registered before PUT /{trip_id}/{activity_id} so "reorder" is not taken as an activity ID
+@router.put("/{trip_id}/reorder")
+async def reorder_activities(trip_id: str, move: ActivityMove, current_user: User = Depends(get_current_user)):
+    """Move one activity to a position within its day (or another day)"""
+    db = await get_database()
+    
+    if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(move.activity_id):
+        raise HTTPException(status_code=400, detail="Invalid ID")
     
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    store = TripStore(db)
+    trip_oid = ObjectId(trip_id)
+    activity_oid = ObjectId(move.activity_id)
     
-    return trip_obj.activities
+    for _ in range(REORDER_ATTEMPTS):
+        trip = await store.load(trip_oid, current_user.id, {"activities._id": 1, "activities.day": 1, "activities.order": 1})
+        activities = trip.get("activities") or []
+        
+        moved = next((a for a in activities if a["_id"] == activity_oid), None)
+        if moved is None:
+            raise HTTPException(status_code=404, detail="Activity not found")
+        source_day = moved.get("day")
+        target_day = move.day if move.day is not None else source_day
+        
+        target = _day_sequence(activities, target_day, activity_oid)
+        target.insert(min(move.position, len(target)), activity_oid)
+        placements = {activity_id: (target_day, order) for order, activity_id in enumerate(target)}
+        if source_day != target_day:
+            placements.update({activity_id: (source_day, order) for order, activity_id in enumerate(_day_sequence(activities, source_day, activity_oid))})
+        
+        # One write that renumbers every affected activity, applied only if the
+        # itinerary still looks exactly as it did when it was read
+        snapshot = [[a["_id"], a.get("day"), a.get("order", 0)] for a in activities]
+        query = store.access_filter(trip_oid, current_user.id)
+        query["$expr"] = {"$eq": [
+            {"$map": {"input": "$activities", "in": [
+                "$$this._id", {"$ifNull": ["$$this.day", None]}, {"$ifNull": ["$$this.order", 0]}
+            ]}},
+            snapshot,
+        ]}
+        ids = list(placements)
+        renumber = [{"$set": {"activities": {"$map": {
+            "input": "$activities",
+            "in": {"$let": {
+                "vars": {"pos": {"$indexOfArray": [ids, "$$this._id"]}},
+                "in": {"$cond": [
+                    {"$gte": ["$$pos", 0]},
+                    {"$mergeObjects": ["$$this", {
+                        "day": {"$arrayElemAt": [[placements[i][0] for i in ids], "$$pos"]},
+                        "order": {"$arrayElemAt": [[placements[i][1] for i in ids], "$$pos"]},
+                    }]},
+                    "$$this",
+                ]},
+            }},
+        }}}}]
+        
+        result = await db.trips.update_one(query, touched(renumber))
+        if result.matched_count:
+            await ChangeLog(db).record(trip_oid, "upsert", "activities", ids)
+            days = {}
+            for activity_id, (day, order) in sorted(placements.items(), key=lambda p: p[1]):
+                days.setdefault(str(day), []).append(str(activity_id))
+            await publish_trip_event(trip_id, "activities.reordered", days=days)
+            return {"day": target_day, "order": [str(activity_id) for activity_id in target]}
+    
+    raise HTTPException(status_code=409, detail="Itinerary changed while reordering, please retry")
 
 @router.put("/{trip_id}/{activity_id}", response_model=Activity)
 async def update_activity(trip_id: str, activity_id: str, activity_update: Activity, current_user: User = Depends(get_current_user)):
@@ -61,24 +162,11 @@ async def update_activity(trip_id: str, activity_id: str, activity_update: Activ
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(activity_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     # Update activity
-    activity_dict = activity_update.dict()
-    activity_dict["_id"] = ObjectId(activity_id)
-    
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id), "activities._id": ObjectId(activity_id)},
-        {"$set": {"activities.$": activity_dict}}
+    activity_dict = await TripStore(db).set_item(
+        ObjectId(trip_id), current_user.id, "activities", ObjectId(activity_id), activity_update.dict()
     )
+    await publish_trip_event(trip_id, "activities.updated", item=item_payload(Activity, activity_dict))
     
     return Activity(**activity_dict)
 
@@ -89,50 +177,8 @@ async def delete_activity(trip_id: str, activity_id: str, current_user: User = D
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(activity_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     # Remove activity
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$pull": {"activities": {"_id": ObjectId(activity_id)}}}
-    )
+    await TripStore(db).pull_item(ObjectId(trip_id), current_user.id, "activities", ObjectId(activity_id))
+    await publish_trip_event(trip_id, "activities.removed", item_id=activity_id)
     
     return {"message": "Activity deleted successfully"}
-
-@router.put("/{trip_id}/reorder")
-async def reorder_activities(trip_id: str, activity_orders: List[dict], current_user: User = Depends(get_current_user)):
-    db = await get_database()
-    
-    if not ObjectId.is_valid(trip_id):
-        raise HTTPException(status_code=400, detail="Invalid trip ID")
-    
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Update activity orders
-    for order_data in activity_orders:
-        activity_id = order_data.get("activity_id")
-        new_order = order_data.get("order")
-        
-        if ObjectId.is_valid(activity_id):
-            await db.trips.update_one(
-                {"_id": ObjectId(trip_id), "activities._id": ObjectId(activity_id)},
-                {"$set": {"activities.$.order": new_order}}
-            )
-    
-    return {"message": "Activities reordered successfully"}
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from typing import Dict, Any, Optional
+from services.profiling import memory_snapshots, secret_matches
+import asyncio
+
+router = APIRouter()
+
+GROUP_BY_PATTERN = "^(lineno|filename|traceback)$"
+
+
+def require_profiling_secret(x_admin_secret: Optional[str] = Header(None)):
+    """Admin endpoints answer only to the profiling secret and look absent otherwise"""
+    if not secret_matches(x_admin_secret):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+def _snapshot_or_404(snapshot_id: int):
+    if memory_snapshots.get(snapshot_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Snapshot {snapshot_id} not found"
+        )
+
+
+@router.get("/memory", dependencies=[Depends(require_profiling_secret)])
+async def memory_status() -> Dict[str, Any]:
+    """
+    Whether tracemalloc is tracing, traced memory and the kept snapshots
+    """
+    return memory_snapshots.status()
+
+
+@router.post("/memory/start", dependencies=[Depends(require_profiling_secret)])
+async def start_memory_tracing(frames: int = Query(1, ge=1, le=64)) -> Dict[str, Any]:
+    """
+    Start tracemalloc, keeping `frames` frames per allocation traceback
+    """
+    return memory_snapshots.start(frames)
+
+
+@router.post("/memory/stop", dependencies=[Depends(require_profiling_secret)])
+async def stop_memory_tracing() -> Dict[str, Any]:
+    """
+    Stop tracemalloc and drop the kept snapshots
+    """
+    return memory_snapshots.stop()
+
+
+@router.post("/memory/snapshot", dependencies=[Depends(require_profiling_secret)])
+async def take_memory_snapshot() -> Dict[str, Any]:
+    """
+    Take a tracemalloc snapshot to diff against later ones
+    """
+    if not memory_snapshots.status()["tracing"]:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Memory tracing is not started"
+        )
+    snapshot_id = await asyncio.to_thread(memory_snapshots.take)
+    return {"id": snapshot_id, **memory_snapshots.status()}
+
+
+@router.get("/memory/snapshot/{snapshot_id}", dependencies=[Depends(require_profiling_secret)])
+async def top_allocations(
+    snapshot_id: int,
+    group_by: str = Query("lineno", pattern=GROUP_BY_PATTERN),
+    include: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=500)
+) -> Dict[str, Any]:
+    """
+    Largest allocation sites of a snapshot; `include` keeps only files whose path contains it
+    """
+    _snapshot_or_404(snapshot_id)
+    stats = await asyncio.to_thread(memory_snapshots.top, snapshot_id, group_by, limit, include)
+    return {"id": snapshot_id, "group_by": group_by, "stats": stats}
+
+
+@router.get("/memory/diff", dependencies=[Depends(require_profiling_secret)])
+async def diff_memory_snapshots(
+    base: int,
+    target: int,
+    group_by: str = Query("lineno", pattern=GROUP_BY_PATTERN),
+    include: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=500)
+) -> Dict[str, Any]:
+    """
+    Allocation growth from snapshot `base` to `target`, largest first.
+    `include=connection_manager` or `include=pydantic` narrows it to one module or package
+    """
+    _snapshot_or_404(base)
+    _snapshot_or_404(target)
+    stats = await asyncio.to_thread(memory_snapshots.diff, base, target, group_by, limit, include)
+    return {"base": base, "target": target, "group_by": group_by, "stats": stats}
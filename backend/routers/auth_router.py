@@ -4,7 +4,7 @@ from models import UserCreate, UserLogin, Token, User, UserUpdate, PasswordChang
 from services.auth_service import AuthService
 from database import get_database
 from config import settings
-from auth import get_current_user
+from auth import get_current_user, get_current_user_from_db, token_claims
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -18,7 +18,7 @@ async def register(user: UserCreate):
         new_user = await auth_service.create_user(user)
         access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
         access_token = auth_service.create_access_token(
-            data={"sub": new_user.email}, expires_delta=access_token_expires
+            data=token_claims(new_user), expires_delta=access_token_expires
         )
         return {"access_token": access_token, "token_type": "bearer"}
     except HTTPException:
@@ -39,12 +39,12 @@ async def login(user_credentials: UserLogin):
         )
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = auth_service.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=User)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user_from_db)):
     return current_user
 
 @router.post("/password-reset/request")
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from models import Expense, Trip, User
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Header, Response
+from typing import List, Optional, Any
+from models import Expense, ExpenseBatchResult, User
 from auth import get_current_user
 from database import get_database
+from services.trip_store import TripStore, window, validate_batch
+from services.expense_service import ExpenseService, TOTALS_PROJECTION, expense_totals_delta, merge_deltas
+from services.trip_events import publish_trip_event, item_payload
+from services.conditional import VERSION_PROJECTION, trip_version, make_etag, etag_matches, cache_headers, not_modified
+from config import settings
 from bson import ObjectId
 
 router = APIRouter()
@@ -14,45 +19,74 @@ async def create_expense(trip_id: str, expense: Expense, current_user: User = De
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Add expense to trip
+    # Add expense to trip; the access check is part of the update filter
     expense_dict = expense.dict()
     expense_dict["_id"] = ObjectId()
     
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$push": {"expenses": expense_dict}}
+    totals = await TripStore(db).push_item(
+        ObjectId(trip_id), current_user.id, "expenses", expense_dict,
+        extra_update={"$inc": expense_totals_delta(expense_dict)},
+        returning=TOTALS_PROJECTION
     )
+    await publish_trip_event(trip_id, "expenses.added", items=[item_payload(Expense, expense_dict)], totals=totals)
     
     return Expense(**expense_dict)
 
-@router.get("/{trip_id}", response_model=List[Expense])
-async def get_trip_expenses(trip_id: str, current_user: User = Depends(get_current_user)):
+@router.post("/{trip_id}/batch", response_model=ExpenseBatchResult)
+async def create_expenses_batch(
+    trip_id: str,
+    items: List[Any] = Body(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Create several expenses in one write; invalid items are reported by index and skipped"""
     db = await get_database()
     
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
+    valid, errors = validate_batch(Expense, items, settings.max_batch_size)
+    item_dicts = []
+    for expense in valid:
+        expense_dict = expense.dict()
+        expense_dict["_id"] = ObjectId()
+        item_dicts.append(expense_dict)
+    
+    totals = await TripStore(db).push_items(
+        ObjectId(trip_id), current_user.id, "expenses", item_dicts,
+        extra_update={"$inc": merge_deltas(*(expense_totals_delta(e) for e in item_dicts))},
+        returning=TOTALS_PROJECTION
+    )
+    await publish_trip_event(trip_id, "expenses.added", items=[item_payload(Expense, e) for e in item_dicts], totals=totals)
+    
+    return {"created": [Expense(**expense_dict) for expense_dict in item_dicts], "errors": errors}
+
+@router.get("/{trip_id}", response_model=List[Expense])
+async def get_trip_expenses(
+    trip_id: str,
+    response: Response,
+    category: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    db = await get_database()
     
-    trip_obj = Trip(**trip)
+    if not ObjectId.is_valid(trip_id):
+        raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Read only the ACL fields and the requested window of expenses
+    cond = {"$eq": ["$$item.category", category]} if category is not None else None
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id,
+        {**VERSION_PROJECTION, "expenses": window("expenses", cond, skip, limit)}
+    )
     
-    return trip_obj.expenses
+    etag = make_etag("expenses", trip_id, trip_version(trip), category, skip, limit)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+    return [Expense(**expense) for expense in trip.get("expenses") or []]
 
 @router.put("/{trip_id}/{expense_id}", response_model=Expense)
 async def update_expense(trip_id: str, expense_id: str, expense_update: Expense, current_user: User = Depends(get_current_user)):
@@ -61,25 +95,18 @@ async def update_expense(trip_id: str, expense_id: str, expense_update: Expense,
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(expense_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Update expense
+    # Update expense, then move its amount between the running totals
     expense_dict = expense_update.dict()
     expense_dict["_id"] = ObjectId(expense_id)
-    
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id), "expenses._id": ObjectId(expense_id)},
-        {"$set": {"expenses.$": expense_dict}}
+    previous = await TripStore(db).set_item(
+        ObjectId(trip_id), current_user.id, "expenses", ObjectId(expense_id), expense_dict,
+        return_before=True
     )
     
+    delta = merge_deltas(expense_totals_delta(previous, -1), expense_totals_delta(expense_dict))
+    totals = await ExpenseService(db).apply_delta(ObjectId(trip_id), delta) if delta else None
+    await publish_trip_event(trip_id, "expenses.updated", item=item_payload(Expense, expense_dict), totals=totals)
+    
     return Expense(**expense_dict)
 
 @router.delete("/{trip_id}/{expense_id}")
@@ -89,21 +116,10 @@ async def delete_expense(trip_id: str, expense_id: str, current_user: User = Dep
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(expense_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Remove expense
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$pull": {"expenses": {"_id": ObjectId(expense_id)}}}
-    )
+    # Remove expense and take it out of the running totals
+    removed = await TripStore(db).pull_item(ObjectId(trip_id), current_user.id, "expenses", ObjectId(expense_id))
+    totals = await ExpenseService(db).apply_delta(ObjectId(trip_id), expense_totals_delta(removed, -1))
+    await publish_trip_event(trip_id, "expenses.removed", item_id=expense_id, totals=totals)
     
     return {"message": "Expense deleted successfully"}
 
@@ -114,29 +130,25 @@ async def get_expense_summary(trip_id: str, current_user: User = Depends(get_cur
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Totals are materialized on the trip, so this reads a handful of fields
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id,
+        {"budget": 1, "total_spent": 1, "category_totals": 1}
+    )
+    if "total_spent" not in trip:
+        # Trip predates materialized totals; compute them once
+        trip.update(await ExpenseService(db).materialize_totals(ObjectId(trip_id)))
     
-    # Calculate summary
-    total_spent = sum(expense.amount for expense in trip_obj.expenses)
-    budget = trip_obj.budget
+    total_spent = round(trip["total_spent"], 2)
+    budget = trip["budget"]
     remaining = budget - total_spent
     
-    # Category breakdown
-    category_totals = {}
-    for expense in trip_obj.expenses:
-        category = expense.category
-        if category in category_totals:
-            category_totals[category] += expense.amount
-        else:
-            category_totals[category] = expense.amount
+    # Category breakdown, skipping categories whose expenses were all removed
+    category_totals = {
+        category: round(amount, 2)
+        for category, amount in (trip.get("category_totals") or {}).items()
+        if round(amount, 2)
+    }
     
     return {
         "budget": budget,
@@ -144,3 +156,13 @@ async def get_expense_summary(trip_id: str, current_user: User = Depends(get_cur
         "remaining": remaining,
         "category_breakdown": category_totals
     }
+
+@router.get("/{trip_id}/breakdown")
+async def get_expense_breakdown(trip_id: str, current_user: User = Depends(get_current_user)):
+    """Per-category and per-day expense totals aggregated by the database"""
+    db = await get_database()
+    
+    if not ObjectId.is_valid(trip_id):
+        raise HTTPException(status_code=400, detail="Invalid trip ID")
+    
+    return await ExpenseService(db).breakdown(ObjectId(trip_id), current_user.id)
@@ -3,6 +3,7 @@ from fastapi.responses import RedirectResponse
 from authlib.integrations.httpx_client import AsyncOAuth2Client
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from services.auth_service import AuthService
+from auth import token_claims
 from database import get_database
 from config import settings
 import secrets
@@ -96,7 +97,7 @@ async def google_callback(request: Request, code: str, state: str):
         )
 
         # Create access token
-        access_token = auth_service.create_access_token(data={"sub": user.email})
+        access_token = auth_service.create_access_token(data=token_claims(user))
 
         # Redirect to frontend with token
         frontend_url = f"http://localhost:3000/auth/callback?token={access_token}&provider=google"
@@ -196,7 +197,7 @@ async def apple_callback(request: Request, code: str, state: str):
         )
 
         # Create access token
-        access_token = auth_service.create_access_token(data={"sub": user.email})
+        access_token = auth_service.create_access_token(data=token_claims(user))
 
         # Redirect to frontend with token
         frontend_url = f"http://localhost:3000/auth/callback?token={access_token}&provider=apple"
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from models import PackingItem, Trip, User
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Header, Response
+from typing import List, Optional, Any
+from models import PackingItem, PackingItemBatchResult, User
 from auth import get_current_user
 from database import get_database
+from services.trip_store import TripStore, window, validate_batch
+from services.trip_events import publish_trip_event, item_payload
+from services.conditional import VERSION_PROJECTION, trip_version, make_etag, etag_matches, cache_headers, not_modified
+from config import settings
 from bson import ObjectId
 
 router = APIRouter()
@@ -14,45 +18,70 @@ async def create_packing_item(trip_id: str, item: PackingItem, current_user: Use
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Add packing item to trip
+    # Add packing item to trip; the access check is part of the update filter
     item_dict = item.dict()
     item_dict["_id"] = ObjectId()
     
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$push": {"packing_items": item_dict}}
-    )
+    await TripStore(db).push_item(ObjectId(trip_id), current_user.id, "packing_items", item_dict)
+    await publish_trip_event(trip_id, "packing_items.added", items=[item_payload(PackingItem, item_dict)])
     
     return PackingItem(**item_dict)
 
-@router.get("/{trip_id}", response_model=List[PackingItem])
-async def get_trip_packing_items(trip_id: str, current_user: User = Depends(get_current_user)):
+@router.post("/{trip_id}/batch", response_model=PackingItemBatchResult)
+async def create_packing_items_batch(
+    trip_id: str,
+    items: List[Any] = Body(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Create several packing items in one write; invalid items are reported by index and skipped"""
     db = await get_database()
     
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
+    valid, errors = validate_batch(PackingItem, items, settings.max_batch_size)
+    item_dicts = []
+    for item in valid:
+        item_dict = item.dict()
+        item_dict["_id"] = ObjectId()
+        item_dicts.append(item_dict)
+    
+    await TripStore(db).push_items(ObjectId(trip_id), current_user.id, "packing_items", item_dicts)
+    await publish_trip_event(trip_id, "packing_items.added", items=[item_payload(PackingItem, i) for i in item_dicts])
+    
+    return {"created": [PackingItem(**item_dict) for item_dict in item_dicts], "errors": errors}
+
+@router.get("/{trip_id}", response_model=List[PackingItem])
+async def get_trip_packing_items(
+    trip_id: str,
+    response: Response,
+    category: Optional[str] = None,
+    packed: Optional[bool] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    db = await get_database()
     
-    trip_obj = Trip(**trip)
+    if not ObjectId.is_valid(trip_id):
+        raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Read only the ACL fields and the matching packing items
+    conditions = []
+    if category is not None:
+        conditions.append({"$eq": ["$$item.category", category]})
+    if packed is not None:
+        conditions.append({"$eq": ["$$item.packed", packed]})
+    cond = {"$and": conditions} if conditions else None
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id,
+        {**VERSION_PROJECTION, "packing_items": window("packing_items", cond)}
+    )
     
-    return trip_obj.packing_items
+    etag = make_etag("packing_items", trip_id, trip_version(trip), category, packed)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+    return [PackingItem(**item) for item in trip.get("packing_items") or []]
 
 @router.put("/{trip_id}/{item_id}", response_model=PackingItem)
 async def update_packing_item(trip_id: str, item_id: str, item_update: PackingItem, current_user: User = Depends(get_current_user)):
@@ -61,24 +90,11 @@ async def update_packing_item(trip_id: str, item_id: str, item_update: PackingIt
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(item_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     # Update packing item
-    item_dict = item_update.dict()
-    item_dict["_id"] = ObjectId(item_id)
-    
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id), "packing_items._id": ObjectId(item_id)},
-        {"$set": {"packing_items.$": item_dict}}
+    item_dict = await TripStore(db).set_item(
+        ObjectId(trip_id), current_user.id, "packing_items", ObjectId(item_id), item_update.dict()
     )
+    await publish_trip_event(trip_id, "packing_items.updated", item=item_payload(PackingItem, item_dict))
     
     return PackingItem(**item_dict)
 
@@ -89,21 +105,9 @@ async def delete_packing_item(trip_id: str, item_id: str, current_user: User = D
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(item_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     # Remove packing item
-    await db.trips.update_one(
-        {"_id": ObjectId(trip_id)},
-        {"$pull": {"packing_items": {"_id": ObjectId(item_id)}}}
-    )
+    await TripStore(db).pull_item(ObjectId(trip_id), current_user.id, "packing_items", ObjectId(item_id))
+    await publish_trip_event(trip_id, "packing_items.removed", item_id=item_id)
     
     return {"message": "Packing item deleted successfully"}
 
@@ -114,27 +118,19 @@ async def toggle_packing_item(trip_id: str, item_id: str, current_user: User = D
     if not ObjectId.is_valid(trip_id) or not ObjectId.is_valid(item_id):
         raise HTTPException(status_code=400, detail="Invalid ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Find the item and toggle its packed status
-    for item in trip_obj.packing_items:
-        if str(item.id) == item_id:
-            new_packed_status = not item.packed
-            await db.trips.update_one(
-                {"_id": ObjectId(trip_id), "packing_items._id": ObjectId(item_id)},
-                {"$set": {"packing_items.$.packed": new_packed_status}}
-            )
-            return {"packed": new_packed_status}
-    
-    raise HTTPException(status_code=404, detail="Packing item not found")
+    # Flip the packed flag server-side so the toggle is a single atomic write
+    item_oid = ObjectId(item_id)
+    toggle = [{"$set": {"packing_items": {"$map": {
+        "input": "$packing_items",
+        "in": {"$cond": [
+            {"$eq": ["$$this._id", item_oid]},
+            {"$mergeObjects": ["$$this", {"packed": {"$not": ["$$this.packed"]}}]},
+            "$$this",
+        ]},
+    }}}}]
+    item = await TripStore(db).update_item(ObjectId(trip_id), current_user.id, "packing_items", item_oid, toggle)
+    await publish_trip_event(trip_id, "packing_items.updated", item=item_payload(PackingItem, item))
+    return {"packed": item["packed"]}
 
 @router.get("/{trip_id}/categories")
 async def get_packing_categories(trip_id: str, current_user: User = Depends(get_current_user)):
@@ -143,19 +139,12 @@ async def get_packing_categories(trip_id: str, current_user: User = Depends(get_
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    trip = await TripStore(db).load(ObjectId(trip_id), current_user.id, {"packing_items": 1})
+    packing_items = [PackingItem(**item) for item in trip.get("packing_items") or []]
     
     # Group items by category
     categories = {}
-    for item in trip_obj.packing_items:
+    for item in packing_items:
         category = item.category
         if category not in categories:
             categories[category] = {"items": [], "packed_count": 0, "total_count": 0}
@@ -1,15 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from typing import List
-from datetime import datetime
-from models import Trip, TripCreate, TripUpdate, User, Activity, Expense
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Query, Header
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from datetime import datetime, timedelta
+from models import (
+    Trip, TripCreate, TripUpdate, TripSummary, TripSummaryPage, TripChangeFeed, TripItemChange, TripDeletion,
+    User, Activity, Expense, PackingItem
+)
 from auth import get_current_user
 from database import get_database
 from bson import ObjectId
-from services.export_service import export_service
+from services.export_service import export_service, pdf_reports
+from services.trip_store import TripStore, ACL_PROJECTION, touched, window
+from services.change_log import ChangeLog
+from services.trip_events import publish_trip_event
+from services.conditional import VERSION_PROJECTION, trip_version, make_etag, etag_matches, cache_headers, not_modified
 from config import settings
+import base64
+import re
 
 router = APIRouter()
 
+TRIP_STATUSES = ("upcoming", "ongoing", "completed")
+
+# Listing projection: header fields plus counts instead of the embedded arrays
+SUMMARY_PROJECTION = {
+    "title": 1,
+    "destination": 1,
+    "start_date": 1,
+    "end_date": 1,
+    "budget": 1,
+    "owner_id": 1,
+    "created_at": 1,
+    "collaborator_count": {"$size": {"$ifNull": ["$collaborators", []]}},
+    "activity_count": {"$size": {"$ifNull": ["$activities", []]}},
+    "expense_count": {"$size": {"$ifNull": ["$expenses", []]}},
+    "packing_count": {"$size": {"$ifNull": ["$packing_items", []]}},
+    "packed_count": {"$size": {"$filter": {
+        "input": {"$ifNull": ["$packing_items", []]},
+        "cond": "$$this.packed",
+    }}},
+    "total_spent": {"$ifNull": ["$total_spent", {"$sum": "$expenses.amount"}]},
+}
+
+# Fields written by the JSON exports
+EXPORT_PROJECTION = {
+    "title": 1,
+    "destination": 1,
+    "start_date": 1,
+    "end_date": 1,
+    "budget": 1,
+    "notes": 1,
+    "activities": 1,
+    "expenses": 1,
+}
+
+# Trips fetched per cursor batch by the bulk export
+EXPORT_BATCH_SIZE = 20
+
+ITEM_MODELS = {"activities": Activity, "expenses": Expense, "packing_items": PackingItem}
+
+def _trip_status(start_date: datetime, end_date: datetime, now: datetime) -> str:
+    """Same rule the dashboard uses to label trips"""
+    if start_date > now:
+        return "upcoming"
+    if end_date > now:
+        return "ongoing"
+    return "completed"
+
+def _status_filter(trip_status: str, now: datetime) -> dict:
+    if trip_status == "upcoming":
+        return {"start_date": {"$gt": now}}
+    if trip_status == "ongoing":
+        return {"start_date": {"$lte": now}, "end_date": {"$gt": now}}
+    return {"end_date": {"$lte": now}}
+
+def _encode_cursor(trip: dict) -> str:
+    raw = f"{trip['created_at'].isoformat()}|{trip['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> dict:
+    """Keyset condition for the page after the given cursor (created_at desc, _id desc)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, trip_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        created_at = datetime.fromisoformat(created_at)
+        trip_id = ObjectId(trip_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": trip_id}},
+    ]}
+
+def _encode_change_cursor(entry_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(f"id:{entry_id}".encode()).decode().rstrip("=")
+
+def _decode_change_cursor(cursor: str) -> ObjectId:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, value = base64.urlsafe_b64decode(padded).decode().split(":")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if prefix == "seq":
+        # Cursor from the old counter-based log; its position cannot be mapped
+        raise HTTPException(status_code=410, detail="Sync cursor expired, reload trips")
+    if prefix != "id" or not ObjectId.is_valid(value):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ObjectId(value)
+
+def _version_timestamp(trip: dict) -> datetime:
+    """When the trip document last changed; trips created before updated_at existed fall back"""
+    return trip.get("updated_at") or trip.get("created_at") or datetime.min
+
+def _chunks(data: bytes, size: int = 64 * 1024):
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield bytes(view[start:start + size])
+
+def _trips_etag(trips: List[dict]) -> str:
+    return make_etag("trips", *(f"{trip['_id']}:{trip_version(trip)}" for trip in trips))
+
 @router.post("/", response_model=Trip)
 async def create_trip(trip: TripCreate, current_user: User = Depends(get_current_user)):
     db = await get_database()
@@ -26,48 +136,214 @@ async def create_trip(trip: TripCreate, current_user: User = Depends(get_current
         "expenses": [],
         "packing_items": [],
         "notes": "",
+        "total_spent": 0.0,
+        "category_totals": {},
+        "version": 0,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
     result = await db.trips.insert_one(trip_dict)
     trip_dict["_id"] = result.inserted_id
+    await ChangeLog(db).record(result.inserted_id, "upsert")
     
     return Trip(**trip_dict)
 
 @router.get("/", response_model=List[Trip])
-async def get_user_trips(current_user: User = Depends(get_current_user)):
+async def get_user_trips(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     db = await get_database()
     
-    trips = []
-    async for trip in db.trips.find({
+    query = {
         "$or": [
             {"owner_id": current_user.id},
             {"collaborators": current_user.id}
         ]
-    }).sort("created_at", -1):
-        trips.append(Trip(**trip))
+    }
     
-    return trips
+    # Revalidate against the ids and versions alone before reading whole trips
+    if if_none_match:
+        versions = await db.trips.find(query, {"_id": 1, **VERSION_PROJECTION}).sort("created_at", -1).to_list(length=None)
+        etag = _trips_etag(versions)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    trips = await db.trips.find(query).sort("created_at", -1).to_list(length=None)
+    response.headers.update(cache_headers(_trips_etag(trips)))
+    return [Trip(**trip) for trip in trips]
+
+@router.get("/summary", response_model=TripSummaryPage)
+async def get_user_trip_summaries(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    trip_status: Optional[str] = Query(None, alias="status"),
+    q: Optional[str] = Query(None, max_length=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Cursor-paginated trip listing with counts instead of embedded items"""
+    db = await get_database()
+    now = datetime.utcnow()
+    
+    conditions = [{"$or": [
+        {"owner_id": current_user.id},
+        {"collaborators": current_user.id}
+    ]}]
+    if trip_status is not None:
+        if trip_status not in TRIP_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(TRIP_STATUSES)}")
+        conditions.append(_status_filter(trip_status, now))
+    if q:
+        pattern = {"$regex": re.escape(q), "$options": "i"}
+        conditions.append({"$or": [{"title": pattern}, {"destination": pattern}]})
+    if cursor:
+        conditions.append(_decode_cursor(cursor))
+    
+    pipeline = [
+        {"$match": {"$and": conditions}},
+        {"$sort": {"created_at": -1, "_id": -1}},
+        {"$limit": limit + 1},
+        {"$project": SUMMARY_PROJECTION},
+    ]
+    trips = await db.trips.aggregate(pipeline).to_list(length=limit + 1)
+    
+    next_cursor = None
+    if len(trips) > limit:
+        trips = trips[:limit]
+        next_cursor = _encode_cursor(trips[-1])
+    
+    items = [
+        TripSummary(**trip, status=_trip_status(trip["start_date"], trip["end_date"], now))
+        for trip in trips
+    ]
+    return TripSummaryPage(items=items, next_cursor=next_cursor)
+
+@router.get("/changes", response_model=TripChangeFeed)
+async def get_trip_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    """Trips and items created, changed or deleted after the `since` cursor.
+
+    Without `since` only the current cursor is returned: load trips in full,
+    then sync from it. A 410 means the cursor is older than the change log
+    and the client must reload in full.
+    """
+    db = await get_database()
+    log = ChangeLog(db)
+    now = datetime.utcnow()
+    # Entries below the cutoff can no longer be in flight; newer ones are held back
+    cutoff = log.cutoff(now - timedelta(seconds=settings.change_feed_settle_seconds))
+    
+    if since is None:
+        return TripChangeFeed(cursor=_encode_change_cursor(cutoff))
+    
+    after = _decode_change_cursor(since)
+    if after.generation_time.replace(tzinfo=None) < now - timedelta(days=settings.change_log_retention_days):
+        raise HTTPException(status_code=410, detail="Sync cursor expired, reload trips")
+    
+    access = {"$or": [{"owner_id": current_user.id}, {"collaborators": current_user.id}]}
+    trip_ids = [trip["_id"] for trip in await db.trips.find(access, {"_id": 1}).to_list(length=None)]
+    entries = await log.since(after, trip_ids, current_user.id, limit + 1)
+    
+    settled = [entry for entry in entries if entry["_id"] < cutoff]
+    # Held back entries mean there is more to fetch once they settle
+    has_more = len(settled) < len(entries) or len(settled) > limit
+    settled = settled[:limit]
+    if not settled:
+        return TripChangeFeed(cursor=since, has_more=has_more)
+    
+    # The current state decides what is reported: items that still exist
+    # are upserts, and tombstones only go out for what is gone
+    deletes = set()
+    changed_trips = set()
+    changed_items = {}
+    for entry in settled:
+        trip_id, field, item_id = entry["trip_id"], entry.get("field"), entry.get("item_id")
+        changed_trips.add(trip_id)
+        if field is not None and item_id not in changed_items.setdefault(field, []):
+            changed_items[field].append(item_id)
+        if entry["op"] == "delete":
+            deletes.add((trip_id, field, item_id))
+    
+    # Current headers of changed trips plus only the changed items, in one read
+    projection = dict(SUMMARY_PROJECTION)
+    for field, item_ids in changed_items.items():
+        projection[field] = window(field, {"$in": ["$$item._id", item_ids]})
+    rows = await db.trips.aggregate([
+        {"$match": {"_id": {"$in": list(changed_trips)}, **access}},
+        {"$project": projection},
+    ]).to_list(length=None)
+    
+    trips, items = [], []
+    present = set()
+    for row in rows:
+        present.add((row["_id"], None, None))
+        for field in changed_items:
+            for item in row.pop(field, None) or []:
+                present.add((row["_id"], field, item["_id"]))
+                items.append(TripItemChange(
+                    trip_id=str(row["_id"]), field=field,
+                    item=ITEM_MODELS[field](**item).model_dump(by_alias=True)
+                ))
+        trips.append(TripSummary(**row, status=_trip_status(row["start_date"], row["end_date"], now)))
+    
+    deleted = [
+        TripDeletion(trip_id=str(trip_id), field=field, item_id=str(item_id) if item_id else None)
+        for trip_id, field, item_id in deletes - present
+    ]
+    
+    return TripChangeFeed(
+        trips=trips, items=items, deleted=deleted,
+        cursor=_encode_change_cursor(settled[-1]["_id"]), has_more=has_more
+    )
+
+@router.get("/export/ndjson")
+async def export_all_trips_ndjson(current_user: User = Depends(get_current_user)):
+    """Stream every trip the user can access as NDJSON, one trip per line"""
+    db = await get_database()
+
+    cursor = db.trips.find(
+        {"$or": [{"owner_id": current_user.id}, {"collaborators": current_user.id}]},
+        {**ACL_PROJECTION, **EXPORT_PROJECTION}
+    ).sort([("created_at", -1), ("_id", -1)]).batch_size(EXPORT_BATCH_SIZE)
+
+    async def lines():
+        # Only the current cursor batch is held in memory
+        async for trip in cursor:
+            yield export_service.ndjson_trip_line(trip)
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=trips.ndjson"}
+    )
 
 @router.get("/{trip_id}", response_model=Trip)
-async def get_trip(trip_id: str, current_user: User = Depends(get_current_user)):
+async def get_trip(
+    trip_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     db = await get_database()
     
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    store = TripStore(db)
+    if if_none_match:
+        trip = await store.load(ObjectId(trip_id), current_user.id, VERSION_PROJECTION)
+        etag = make_etag("trip", trip_id, trip_version(trip))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
     
-    return trip_obj
+    trip = await store.load(ObjectId(trip_id), current_user.id)
+    response.headers.update(cache_headers(make_etag("trip", trip_id, trip_version(trip))))
+    return Trip(**trip)
 
 @router.put("/{trip_id}", response_model=Trip)
 async def update_trip(trip_id: str, trip_update: TripUpdate, current_user: User = Depends(get_current_user)):
@@ -76,24 +352,21 @@ async def update_trip(trip_id: str, trip_update: TripUpdate, current_user: User
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
     # Check if user is the owner
-    if trip_obj.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only trip owner can update trip details")
+    await TripStore(db).load(
+        ObjectId(trip_id), current_user.id, {},
+        owner_only=True, forbidden_detail="Only trip owner can update trip details"
+    )
     
     # Update only provided fields
     update_data = {k: v for k, v in trip_update.dict().items() if v is not None}
     if update_data:
-        update_data["updated_at"] = datetime.utcnow()
         await db.trips.update_one(
             {"_id": ObjectId(trip_id)},
-            {"$set": update_data}
+            touched({"$set": update_data})
         )
+        await ChangeLog(db).record(ObjectId(trip_id), "upsert")
+        await publish_trip_event(trip_id, "trip.updated", changes=update_data)
     
     # Return updated trip
     updated_trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
@@ -106,17 +379,18 @@ async def delete_trip(trip_id: str, current_user: User = Depends(get_current_use
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
     # Check if user is the owner
-    if trip_obj.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only trip owner can delete trip")
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id, {},
+        owner_only=True, forbidden_detail="Only trip owner can delete trip"
+    )
     
     await db.trips.delete_one({"_id": ObjectId(trip_id)})
+    # The tombstone carries its audience since the trip can no longer be checked
+    await ChangeLog(db).record(
+        ObjectId(trip_id), "delete", audience=[trip["owner_id"], *trip.get("collaborators", [])]
+    )
+    await publish_trip_event(trip_id, "trip.deleted")
     return {"message": "Trip deleted successfully"}
 
 @router.post("/{trip_id}/collaborators/{user_email}")
@@ -126,15 +400,11 @@ async def add_collaborator(trip_id: str, user_email: str, current_user: User = D
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip_obj = Trip(**trip)
-    
     # Check if user is the owner
-    if trip_obj.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only trip owner can add collaborators")
+    trip = await TripStore(db).load(
+        ObjectId(trip_id), current_user.id, {},
+        owner_only=True, forbidden_detail="Only trip owner can add collaborators"
+    )
     
     # Find user by email
     user = await db.users.find_one({"email": user_email})
@@ -144,11 +414,13 @@ async def add_collaborator(trip_id: str, user_email: str, current_user: User = D
     user_obj = User(**user)
     
     # Add collaborator if not already added
-    if user_obj.id not in trip_obj.collaborators:
+    if user_obj.id not in trip.get("collaborators", []):
         await db.trips.update_one(
             {"_id": ObjectId(trip_id)},
-            {"$push": {"collaborators": user_obj.id}}
+            touched({"$push": {"collaborators": user_obj.id}})
         )
+        await ChangeLog(db).record(ObjectId(trip_id), "upsert")
+        await publish_trip_event(trip_id, "trip.collaborator_added", user_id=user_obj.id)
     
     return {"message": "Collaborator added successfully"}
 
@@ -160,32 +432,36 @@ async def join_trip(trip_id: str, current_user: User = Depends(get_current_user)
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
     
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
+    trip = await db.trips.find_one({"_id": ObjectId(trip_id)}, ACL_PROJECTION)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    trip_obj = Trip(**trip)
-    
     # Check if user is already the owner
-    if trip_obj.owner_id == current_user.id:
+    if trip["owner_id"] == current_user.id:
         raise HTTPException(status_code=400, detail="You are already the owner of this trip")
     
     # Check if user is already a collaborator
-    if current_user.id in trip_obj.collaborators:
+    if current_user.id in trip.get("collaborators", []):
         raise HTTPException(status_code=400, detail="You are already a collaborator of this trip")
     
     # Add user as collaborator
     await db.trips.update_one(
         {"_id": ObjectId(trip_id)},
-        {"$push": {"collaborators": current_user.id}}
+        touched({"$push": {"collaborators": current_user.id}})
     )
+    await ChangeLog(db).record(ObjectId(trip_id), "upsert")
+    await publish_trip_event(trip_id, "trip.collaborator_added", user_id=current_user.id)
     
     # Return the trip details
     updated_trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
     return Trip(**updated_trip)
 
 @router.get("/{trip_id}/export/pdf")
-async def export_trip_pdf(trip_id: str, current_user: User = Depends(get_current_user)):
+async def export_trip_pdf(
+    trip_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     """Export trip as PDF report"""
     if not settings.enable_pdf_export:
         raise HTTPException(status_code=403, detail="PDF export is disabled")
@@ -195,33 +471,23 @@ async def export_trip_pdf(trip_id: str, current_user: User = Depends(get_current
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
 
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
+    # Every trip write bumps updated_at, so it identifies the report content
+    store = TripStore(db)
+    trip = await store.load(ObjectId(trip_id), current_user.id, {"title": 1, "created_at": 1, "updated_at": 1})
+    key = pdf_reports.key(trip_id, _version_timestamp(trip))
+    pdf_data = pdf_reports.get(key)
+    if pdf_data is None and not etag_matches(if_none_match, f'"{key}"'):
+        trip = await store.load(ObjectId(trip_id), current_user.id)
+        key = pdf_reports.key(trip_id, _version_timestamp(trip))
+        pdf_data = pdf_reports.get(key) or await pdf_reports.render(key, trip)
 
-    trip_obj = Trip(**trip)
+    headers = cache_headers(f'"{key}"')
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers["ETag"])
 
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    # Get activities and expenses
-    activities = []
-    async for activity in db.activities.find({"trip_id": ObjectId(trip_id)}):
-        activities.append(Activity(**activity))
-
-    expenses = []
-    async for expense in db.expenses.find({"trip_id": ObjectId(trip_id)}):
-        expenses.append(Expense(**expense))
-
-    # Generate PDF
-    pdf_data = export_service.generate_trip_pdf(trip_obj, activities, expenses)
-
-    return Response(
-        content=pdf_data,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={trip_obj.title.replace(' ', '_')}_report.pdf"}
-    )
+    headers["Content-Length"] = str(len(pdf_data))
+    headers["Content-Disposition"] = f"attachment; filename={trip['title'].replace(' ', '_')}_report.pdf"
+    return StreamingResponse(_chunks(pdf_data), media_type="application/pdf", headers=headers)
 
 @router.get("/{trip_id}/export/calendar")
 async def export_trip_calendar(trip_id: str, current_user: User = Depends(get_current_user)):
@@ -234,15 +500,7 @@ async def export_trip_calendar(trip_id: str, current_user: User = Depends(get_cu
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
 
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-
-    trip_obj = Trip(**trip)
-
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    trip_obj = Trip(**await TripStore(db).load(ObjectId(trip_id), current_user.id))
 
     # Get activities
     activities = []
@@ -266,30 +524,10 @@ async def export_trip_json(trip_id: str, current_user: User = Depends(get_curren
     if not ObjectId.is_valid(trip_id):
         raise HTTPException(status_code=400, detail="Invalid trip ID")
 
-    trip = await db.trips.find_one({"_id": ObjectId(trip_id)})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-
-    trip_obj = Trip(**trip)
-
-    # Check if user has access to this trip
-    if trip_obj.owner_id != current_user.id and current_user.id not in trip_obj.collaborators:
-        raise HTTPException(status_code=403, detail="Access denied")
+    trip = await TripStore(db).load(ObjectId(trip_id), current_user.id, EXPORT_PROJECTION)
 
-    # Get activities and expenses
-    activities = []
-    async for activity in db.activities.find({"trip_id": ObjectId(trip_id)}):
-        activities.append(Activity(**activity))
-
-    expenses = []
-    async for expense in db.expenses.find({"trip_id": ObjectId(trip_id)}):
-        expenses.append(Expense(**expense))
-
-    # Generate JSON export
-    json_data = export_service.export_trip_data(trip_obj, activities, expenses)
-
-    return Response(
-        content=json_data,
+    return StreamingResponse(
+        export_service.stream_trip_data(trip),
         media_type="application/json",
-        headers={"Content-Disposition": f"attachment; filename={trip_obj.title.replace(' ', '_')}_data.json"}
+        headers={"Content-Disposition": f"attachment; filename={trip['title'].replace(' ', '_')}_data.json"}
     )
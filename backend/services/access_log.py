@@ -0,0 +1,154 @@
+from typing import Any, Dict, Optional, Tuple
+from services.metrics import route_label
+from config import settings
+import logging
+import orjson
+import queue
+import random
+import sys
+import threading
+import time
+
+# Plain access lines go where uvicorn logs; structured ones are printed as JSON lines
+logger = logging.getLogger("uvicorn")
+
+# (timestamp, method, route, status, duration_ms, bytes, client)
+Record = Tuple[float, str, str, int, float, int, Optional[str]]
+
+
+def format_record(record: Record, structured: bool) -> str:
+    at, method, route, status, duration_ms, size, client = record
+    if structured:
+        return orjson.dumps({
+            "event": "request",
+            "at": at,
+            "method": method,
+            "route": route,
+            "status": status,
+            "duration_ms": duration_ms,
+            "bytes": size,
+            "client": client,
+        }).decode()
+    return f'{client or "-"} "{method} {route}" {status} {size}B {duration_ms}ms'
+
+
+class AccessLogWriter:
+    """Formats and writes access log records on a background thread.
+
+    Requests only put a tuple on a bounded queue. When the queue is full,
+    records of successful requests are dropped and counted, but error
+    records are written directly instead so they are never lost.
+    """
+
+    def __init__(self, max_queued: int, structured: bool):
+        self.structured = structured
+        self._queue: "queue.Queue[Optional[Record]]" = queue.Queue(maxsize=max_queued)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+                    self._thread.start()
+
+    def submit(self, record: Record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if record[3] >= 400:
+                self._write(record)
+            else:
+                self.dropped += 1
+
+    def _write(self, record: Record):
+        line = format_record(record, self.structured)
+        if self.structured:
+            sys.stdout.write(line + "\n")
+        else:
+            logger.info(line)
+        self.written += 1
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                sys.stdout.flush()
+                return
+            try:
+                self._write(record)
+            except Exception:
+                pass
+            if self._queue.empty():
+                sys.stdout.flush()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush what is queued and stop the thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+
+class AccessLogMiddleware:
+    """Records method, route template, status, duration and response bytes.
+
+    Responses below 400 are logged with probability `sample_rate`; errors
+    are always logged. Nothing is formatted on the request path.
+    """
+
+    def __init__(self, app, writer: "AccessLogWriter" = None, sample_rate: Optional[float] = None):
+        self.app = app
+        self.writer = writer or access_log
+        self.sample_rate = settings.access_log_sample_rate if sample_rate is None else sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if status_code >= 400 or self.sample_rate >= 1 or random.random() < self.sample_rate:
+                client = scope.get("client")
+                self.writer.submit((
+                    time.time(),
+                    scope["method"],
+                    route_label(scope),
+                    status_code,
+                    round((time.perf_counter() - start) * 1000, 2),
+                    size,
+                    client[0] if client else None,
+                ))
+            else:
+                self.writer.sampled_out += 1
+
+
+access_log = AccessLogWriter(settings.access_log_queue_size, settings.enable_structured_logging)
@@ -1,28 +1,27 @@
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import HTTPException, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import User, UserCreate, TokenData
 from config import settings
+from auth import principal_cache
+from services.password_hasher import password_hasher
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import secrets
 import string
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class AuthService:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
 
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await password_hasher.verify(plain_password, hashed_password)
 
-    def get_password_hash(self, password: str) -> str:
-        return pwd_context.hash(password)
+    async def get_password_hash(self, password: str) -> str:
+        return await password_hasher.hash(password)
 
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None):
         to_encode = data.copy()
@@ -38,7 +37,7 @@ class AuthService:
         user = await self.db.users.find_one({"email": email})
         if not user:
             return None
-        if not self.verify_password(password, user["hashed_password"]):
+        if not await self.verify_password(password, user["hashed_password"]):
             return None
         return User(**user)
 
@@ -59,7 +58,7 @@ class AuthService:
             "email": user.email,
             "username": user.username,
             "name": user.name,
-            "hashed_password": self.get_password_hash(user.password),
+            "hashed_password": await self.get_password_hash(user.password),
             "created_at": datetime.utcnow(),
             "profile": {}
         }
@@ -130,12 +129,14 @@ class AuthService:
             )
 
         # Update user password
-        hashed_password = self.get_password_hash(new_password)
+        hashed_password = await self.get_password_hash(new_password)
         await self.db.users.update_one(
             {"email": reset_request["email"]},
             {"$set": {"hashed_password": hashed_password}}
         )
 
+        principal_cache.invalidate(reset_request["email"])
+
         # Delete used reset token
         await self.db.password_resets.delete_one({"token": token})
 
@@ -209,6 +210,7 @@ class AuthService:
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        principal_cache.invalidate_user_id(user_id)
         
         # Return updated user
         updated_user = await self.db.users.find_one({"_id": user_id})
@@ -216,11 +218,12 @@ class AuthService:
 
     async def update_user_password(self, user_id: str, new_password: str) -> bool:
         """Update user password"""
-        hashed_password = self.get_password_hash(new_password)
+        hashed_password = await self.get_password_hash(new_password)
         
         result = await self.db.users.update_one(
             {"_id": user_id},
             {"$set": {"hashed_password": hashed_password}}
         )
+        principal_cache.invalidate_user_id(user_id)
         
         return result.modified_count > 0
\ No newline at end of file
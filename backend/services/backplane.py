@@ -0,0 +1,289 @@
+from typing import Awaitable, Callable, Dict, Optional, Set
+from abc import ABC, abstractmethod
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid
+from config import settings
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Called with (trip_id, message, seq, epoch) for every message published on any worker
+Handler = Callable[[str, str, int, str], Awaitable[None]]
+
+
+# Longest line on the hub socket: a message of the WebSocket size limit,
+# with room for JSON escaping and the envelope. Longer messages are dropped
+# by the publisher instead of breaking the hub connection.
+UNIX_LINE_LIMIT = 2 * settings.ws_max_message_bytes + 4096
+
+
+def _new_epoch() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class Backplane(ABC):
+    """Carries trip channel messages between worker processes.
+
+    `publish` hands a message to every worker, this one included, and each
+    worker delivers it to its own sockets through the handler given to
+    `start`. Going through the backplane for local delivery too keeps the
+    order of messages the same on every worker.
+
+    Each message is stamped with a per-trip sequence number at a single
+    point, so every worker sees the same numbers and a client can resume
+    on any of them. Numbers are only comparable within one epoch; the
+    epoch changes whenever the sequence restarts.
+    """
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    @abstractmethod
+    async def publish(self, trip_id: str, message: str):
+        """Send a message to every worker; implementations stamp seq and epoch"""
+
+    async def close(self):
+        pass
+
+    async def _dispatch(self, trip_id: str, message: str, seq: int, epoch: str):
+        try:
+            await self._handler(trip_id, message, seq, epoch)
+        except Exception as e:
+            logger.error(f"Backplane delivery error for trip {trip_id}: {e}")
+
+
+class InMemoryBackplane(Backplane):
+    """Single-process backplane; the default when running one worker"""
+
+    def __init__(self):
+        super().__init__()
+        self.epoch = _new_epoch()
+        self._seqs: Dict[str, int] = {}
+
+    async def publish(self, trip_id: str, message: str):
+        seq = self._seqs[trip_id] = self._seqs.get(trip_id, 0) + 1
+        await self._dispatch(trip_id, message, seq, self.epoch)
+
+
+class UnixSocketBackplane(Backplane):
+    """Workers on one host relay messages through a hub on a Unix socket.
+
+    Whichever worker holds the lock file runs the hub; every worker,
+    including that one, connects to it as a client. The hub stamps each
+    line it receives with the trip's next sequence number and writes it to
+    all clients. If the hub's worker exits, the lock is released and the
+    next worker to reconnect takes over with a new epoch.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._hub_epoch = _new_epoch()
+        self._hub_seqs: Dict[str, int] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning(f"Backplane hub at {self.path} not reachable yet")
+
+    def _try_become_hub(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while line := await self._readline(reader):
+                try:
+                    envelope = json.loads(line)
+                    trip_id = envelope["trip_id"]
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error(f"Backplane hub dropped a malformed line: {e}")
+                    continue
+                envelope["seq"] = self._hub_seqs[trip_id] = self._hub_seqs.get(trip_id, 0) + 1
+                envelope["epoch"] = self._hub_epoch
+                line = json.dumps(envelope).encode() + b"\n"
+                for peer in list(self._peers):
+                    try:
+                        peer.write(line)
+                    except Exception:
+                        self._peers.discard(peer)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _run(self):
+        delay = 0.1
+        while True:
+            if self._server is None and self._try_become_hub():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=UNIX_LINE_LIMIT)
+                logger.info(f"Backplane hub listening on {self.path}")
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=UNIX_LINE_LIMIT)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+
+            delay = 0.1
+            self._connected.set()
+            try:
+                while line := await self._readline(reader):
+                    try:
+                        envelope = json.loads(line)
+                        trip_id, message = envelope["trip_id"], envelope["message"]
+                        seq, epoch = envelope["seq"], envelope["epoch"]
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.error(f"Backplane dropped a malformed line from the hub: {e}")
+                        continue
+                    await self._dispatch(trip_id, message, seq, epoch)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self._connected.clear()
+                self._writer.close()
+                self._writer = None
+            logger.warning("Lost backplane hub connection, reconnecting")
+
+    @staticmethod
+    async def _readline(reader: asyncio.StreamReader) -> bytes:
+        """Next line, skipping any longer than UNIX_LINE_LIMIT; b"" at EOF"""
+        while True:
+            try:
+                return await reader.readline()
+            except ValueError:
+                # readline() has already discarded the oversized line
+                logger.error("Backplane dropped a line over the size limit")
+
+    async def publish(self, trip_id: str, message: str):
+        writer = self._writer
+        if writer is None:
+            logger.warning(f"Backplane disconnected, dropping message for trip {trip_id}")
+            return
+        line = json.dumps({"trip_id": trip_id, "message": message}).encode() + b"\n"
+        # The hub adds seq and epoch to the line before relaying it
+        if len(line) > UNIX_LINE_LIMIT - 256:
+            logger.error(f"Backplane message for trip {trip_id} is {len(line)} bytes, over the limit; dropped")
+            return
+        try:
+            writer.write(line)
+            await writer.drain()
+        except ConnectionError as e:
+            # _run notices the lost connection and reconnects
+            logger.warning(f"Backplane publish failed, dropping message for trip {trip_id}: {e}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class MongoBackplane(Backplane):
+    """Workers on any host exchange messages through a capped collection.
+
+    Messages are inserted into the collection and every worker follows it
+    with a tailable cursor, so no extra service is needed beyond MongoDB.
+    Messages published while a worker's cursor is being re-established
+    may be missed by that worker. Sequence numbers come from a counter
+    document per trip, so they survive restarts and the epoch is fixed;
+    concurrent publishers on different workers may insert slightly out of
+    sequence order.
+    """
+
+    epoch = "mongo"
+
+    def __init__(self, database, collection: str, size_bytes: int):
+        super().__init__()
+        self.database = database
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        try:
+            await self.database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail())
+
+    async def _tail(self):
+        collection = self.database[self.collection_name]
+        # Start after whatever is already in the collection
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for event in cursor:
+                        last_id = event["_id"]
+                        await self._dispatch(event["trip_id"], event["message"], event["seq"], self.epoch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane tail error: {e}")
+            await asyncio.sleep(1)
+
+    async def publish(self, trip_id: str, message: str):
+        counter = await self.database.counters.find_one_and_update(
+            {"_id": f"ws:{trip_id}"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        await self.database[self.collection_name].insert_one(
+            {"trip_id": trip_id, "message": message, "seq": counter["seq"]}
+        )
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+
+def create_backplane(database=None) -> Backplane:
+    """Backplane selected by settings.realtime_backplane"""
+    kind = settings.realtime_backplane
+    if kind == "unix":
+        return UnixSocketBackplane(settings.realtime_socket_path)
+    if kind == "mongo":
+        return MongoBackplane(database, settings.realtime_events_collection, settings.realtime_events_size_bytes)
+    return InMemoryBackplane()
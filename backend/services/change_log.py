@@ -0,0 +1,61 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+
+
+class ChangeLog:
+    """Append-only log of trip writes that backs the delta-sync feed.
+
+    Writers record an entry once their write has committed, so the state
+    the feed reads already includes it. Entries are ordered by their `_id`,
+    an ObjectId made by the writer, so recording a change is a single
+    insert and `_id` serves as the sync cursor. ObjectIds only order by
+    the second across workers and inserts land out of order, so readers
+    stop at a settled cutoff (`cutoff()`) instead of reading to the end.
+
+    An entry names the trip and, for embedded items, the array field and
+    item id; it never stores the data itself, the feed reads the current
+    state. Trip deletions also record who could see the trip, because the
+    trip is gone by the time its tombstone is read. Entries expire through
+    a TTL index on `at`.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    async def record(self, trip_id: ObjectId, op: str, field: Optional[str] = None,
+                     item_ids: Optional[List[ObjectId]] = None,
+                     audience: Optional[List[str]] = None) -> None:
+        """Log an "upsert" or "delete" of a trip, or of items in one of its arrays"""
+        targets = item_ids if field else [None]
+        if not targets:
+            return
+        now = datetime.utcnow()
+        entries = []
+        for item_id in targets:
+            entry = {"_id": ObjectId(), "trip_id": trip_id, "op": op, "at": now}
+            if field:
+                entry["field"] = field
+                entry["item_id"] = item_id
+            if audience:
+                entry["audience"] = audience
+            entries.append(entry)
+        await self.db.trip_changes.insert_many(entries, ordered=False)
+
+    @staticmethod
+    def cutoff(settled_before: datetime) -> ObjectId:
+        """Smallest entry id of the second containing `settled_before`.
+
+        Entries below it were all created before that second began; the
+        settle time covers inserts from other workers landing out of order.
+        """
+        return ObjectId.from_datetime(settled_before)
+
+    async def since(self, after: ObjectId, trip_ids: List[ObjectId], user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Entries after `after` for the given trips plus tombstones addressed to the user"""
+        query = {
+            "_id": {"$gt": after},
+            "$or": [{"trip_id": {"$in": trip_ids}}, {"audience": user_id}],
+        }
+        return await self.db.trip_changes.find(query).sort("_id", 1).limit(limit).to_list(length=limit)
@@ -0,0 +1,44 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+from fastapi import Response
+import hashlib
+
+# Fields that identify the current state of a trip document
+VERSION_PROJECTION = {"version": 1, "updated_at": 1, "created_at": 1}
+
+
+def trip_version(trip: Dict[str, Any]) -> str:
+    """Version token of a (possibly projected) trip document.
+
+    Trips written before the version counter existed fall back to updated_at;
+    their first write sets the counter.
+    """
+    if "version" in trip:
+        return f"v{trip['version']}"
+    return (trip.get("updated_at") or trip.get("created_at") or datetime.min).isoformat()
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag for a representation identified by `parts`.
+
+    Include the trip version and every parameter that shapes the body
+    (resource name, filters, window), so each distinct body gets its own tag.
+    """
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    # Clients may keep the body but must revalidate before reusing it
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
@@ -0,0 +1,471 @@
+from typing import Dict, List, Any, Optional, Deque, Tuple, Union
+from collections import OrderedDict, deque
+from fastapi import WebSocket
+from services.backplane import Backplane, InMemoryBackplane
+from config import settings
+import asyncio
+import json
+import logging
+import msgpack
+import time
+
+logger = logging.getLogger(__name__)
+
+# Close code for clients evicted because they could not keep up (Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code for clients that stopped answering heartbeats (Going Away)
+IDLE_CLOSE_CODE = 1001
+# Close code for handshakes refused because the connection limits are reached
+CAPACITY_CLOSE_CODE = 1013
+
+# WebSocket subprotocols; clients that ask for none get JSON text frames
+MSGPACK_SUBPROTOCOL = "travelmate.msgpack"
+JSON_SUBPROTOCOL = "travelmate.json"
+
+
+class Frame:
+    """One outgoing message, encoded at most once per wire format.
+
+    The payload is shared by every connection on the trip and by the replay
+    buffer, so JSON text and MessagePack bytes are each produced once per
+    worker, not once per socket.
+    """
+
+    __slots__ = ("seq", "payload", "_text", "_binary", "_size")
+
+    def __init__(self, seq: Optional[int], payload: Dict[str, Any]):
+        self.seq = seq
+        self.payload = payload
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+        self._size: Optional[int] = None
+
+    def wire_size(self) -> int:
+        """Length of an encoding already produced, fixed once measured.
+
+        Never encodes: a frame no socket on this worker received counts as 0.
+        """
+        if self._size is None:
+            encoded = self._binary if self._binary is not None else self._text
+            self._size = len(encoded) if encoded is not None else 0
+        return self._size
+
+    @property
+    def coalesce_key(self) -> Optional[Tuple[str, str]]:
+        """Item updates carry the full item, so only the latest one per item matters"""
+        kind = self.payload.get("type")
+        item = self.payload.get("item")
+        if isinstance(kind, str) and kind.endswith(".updated") and isinstance(item, dict) and "_id" in item:
+            return kind, str(item["_id"])
+        return None
+
+    def encode(self, binary: bool) -> Union[str, bytes]:
+        if binary:
+            if self._binary is None:
+                self._binary = msgpack.packb(self.payload, use_bin_type=True)
+            return self._binary
+        if self._text is None:
+            self._text = json.dumps(self.payload)
+        return self._text
+
+
+def stamp(message: str, seq: Optional[int]) -> Frame:
+    """Wrap a channel message and add its sequence number.
+
+    JSON objects get a "seq" field; anything else is wrapped as
+    {"type": "message", "data": ...}.
+    """
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        payload = {"type": "message", "data": message}
+    if seq is not None:
+        payload["seq"] = seq
+    return Frame(seq, payload)
+
+
+def control_frame(kind: str, seq: int, epoch: Optional[str], **extra: Any) -> Frame:
+    return Frame(None, {"type": f"channel.{kind}", "seq": seq, "epoch": epoch, **extra})
+
+
+# Heartbeat sent to every connection; clients answer with {"type": "channel.pong"}
+PING_FRAME = Frame(None, {"type": "channel.ping"})
+
+
+def is_pong(message: str) -> bool:
+    """Whether a client message answers a heartbeat; those are not relayed"""
+    if "channel.pong" not in message:
+        return False
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get("type") == "channel.pong"
+
+
+class ReplayBuffer:
+    """The most recent stamped messages of one trip channel.
+
+    Coalesced updates leave gaps in the sequence, so instead of checking
+    for every number the buffer tracks `floor`, the first sequence number
+    from which everything is still represented.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.epoch: Optional[str] = None
+        self.head = 0
+        self.floor: Optional[int] = None
+        self.frames: Deque[Frame] = deque()
+        self.bytes = 0
+
+    def reset(self, epoch: str):
+        self.epoch = epoch
+        self.head = 0
+        self.floor = None
+        self.frames.clear()
+        self.bytes = 0
+
+    def append(self, frame: Frame):
+        if self.floor is None:
+            self.floor = frame.seq
+        self.head = max(self.head, frame.seq)
+        self.frames.append(frame)
+        self.bytes += frame.wire_size()
+        while len(self.frames) > self.size:
+            evicted = self.frames.popleft()
+            self.floor = evicted.seq + 1
+            self.bytes -= evicted.wire_size()
+
+    def missed(self, last_seq: int) -> Optional[List[Frame]]:
+        """Frames after `last_seq`, or None when some of them are no longer held"""
+        if last_seq > self.head:
+            return None
+        if last_seq == self.head:
+            return []
+        if self.floor is None or last_seq + 1 < self.floor:
+            return None
+        return sorted((frame for frame in self.frames if frame.seq > last_seq), key=lambda frame: frame.seq)
+
+
+class TripConnection:
+    """A socket with its own bounded outbound queue drained by a writer task.
+
+    Broadcasting only enqueues, so a slow client delays nobody but itself.
+    When its queue overflows or a single send stalls past the timeout, the
+    client is evicted and has to reconnect. Clients that negotiated the
+    MessagePack subprotocol get binary frames.
+    """
+
+    def __init__(self, websocket: WebSocket, trip_id: str, manager: "ConnectionManager", binary: bool = False):
+        self.websocket = websocket
+        self.trip_id = trip_id
+        self.manager = manager
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+        self.closed = False
+        self.sent = 0
+        self.queued_bytes = 0  # encoded size of the frames waiting in the queue
+        self.last_seen = self.last_ping = time.monotonic()
+        self._writer = asyncio.create_task(self._write())
+
+    def touch(self):
+        """Record that the client sent something, pongs included"""
+        self.last_seen = time.monotonic()
+
+    def offer(self, frame: Frame) -> bool:
+        """Queue a frame without waiting; False when the queue is full"""
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            return False
+        # Encoded once per format and cached, so the writer reuses this
+        self.queued_bytes += len(frame.encode(self.binary))
+        return True
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                encoded = frame.encode(self.binary)
+                self.queued_bytes -= len(encoded)
+                if self.binary:
+                    send = self.websocket.send_bytes(encoded)
+                else:
+                    send = self.websocket.send_text(encoded)
+                await asyncio.wait_for(send, settings.ws_send_timeout_seconds)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.manager.evict(self, "send timed out")
+        except Exception:
+            self.manager.remove(self)
+
+    def close(self, code: Optional[int] = None):
+        """Stop the writer and optionally close the socket, without waiting on the client"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), settings.ws_send_timeout_seconds)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """WebSocket connections per trip on this worker.
+
+    Broadcasts go through the backplane so that clients connected to other
+    worker processes receive them too; delivery to each local socket goes
+    through that socket's TripConnection queue.
+
+    Every worker keeps the last messages of recently active trips in a
+    replay buffer, so a client that reconnects with the `last_seq` and
+    `epoch` it saw gets what it missed instead of reloading the trip. When
+    the gap is no longer buffered it is told to resync.
+
+    Messages are held for `ws_coalesce_window_ms` before they go out, and
+    an item update replaces an earlier update of the same item still
+    waiting in that window, so a burst of toggles costs one frame.
+
+    A background reaper pings every connection each `ws_ping_interval_seconds`
+    and closes those that have sent nothing, not even a pong, for
+    `ws_idle_timeout_seconds`, so half-open mobile sockets do not pile up.
+    """
+
+    def __init__(self, backplane: Backplane = None):
+        self.active_connections: Dict[str, List[TripConnection]] = {}
+        self.backplane = backplane or InMemoryBackplane()
+        self.replay: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+        self._pending: Dict[str, "OrderedDict[Any, Frame]"] = {}
+        self.dropped = 0
+        self.evicted = 0
+        self.resumed = 0
+        self.resyncs = 0
+        self.coalesced = 0
+        self.reaped = 0
+        self.rejected = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self, backplane: Backplane):
+        self.backplane = backplane
+        await backplane.start(self.deliver)
+        self._reaper = asyncio.create_task(self._reap())
+
+    async def stop(self):
+        if self._reaper:
+            self._reaper.cancel()
+        await self.backplane.close()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                self.remove(connection)
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def at_capacity(self, trip_id: str) -> bool:
+        """Whether a new socket for the trip would exceed the per-trip or worker limit"""
+        full = (len(self.active_connections.get(trip_id, [])) >= settings.ws_max_connections_per_trip
+                or self.connection_count() >= settings.ws_max_connections)
+        if full:
+            self.rejected += 1
+        return full
+
+    @staticmethod
+    def _subprotocol(websocket: WebSocket) -> Optional[str]:
+        offered = websocket.scope.get("subprotocols") or []
+        return next((p for p in offered if p in (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)), None)
+
+    async def refuse(self, websocket: WebSocket, code: int):
+        """Accept and immediately close with `code`.
+
+        Closing before accepting rejects the handshake, which clients only
+        see as an HTTP 403, so codes such as CAPACITY_CLOSE_CODE need a
+        completed handshake to reach them.
+        """
+        await websocket.accept(subprotocol=self._subprotocol(websocket))
+        await websocket.close(code=code)
+
+    async def connect(self, websocket: WebSocket, trip_id: str,
+                      last_seq: Optional[int] = None, epoch: Optional[str] = None) -> TripConnection:
+        subprotocol = self._subprotocol(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        # From here on nothing awaits, so no broadcast can slip in between
+        # the replayed frames and the live ones
+        buffer = self.replay.get(trip_id)
+        head = buffer.head if buffer else 0
+        current_epoch = buffer.epoch if buffer else None
+        frames = [control_frame("ready", head, current_epoch)]
+        if last_seq is not None:
+            missed = buffer.missed(last_seq) if buffer and epoch == current_epoch else None
+            if missed is None or len(missed) >= settings.ws_send_queue_size:
+                self.resyncs += 1
+                frames = [control_frame("resync", head, current_epoch)]
+            else:
+                self.resumed += 1
+                frames = [control_frame("resumed", head, current_epoch, replayed=len(missed))] + missed
+        
+        connection = TripConnection(websocket, trip_id, self, binary=subprotocol == MSGPACK_SUBPROTOCOL)
+        for frame in frames:
+            connection.offer(frame)
+        if trip_id not in self.active_connections:
+            self.active_connections[trip_id] = []
+        self.active_connections[trip_id].append(connection)
+        return connection
+
+    def remove(self, connection: TripConnection, code: Optional[int] = None):
+        connection.close(code)
+        connections = self.active_connections.get(connection.trip_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.trip_id]
+
+    def disconnect(self, websocket: WebSocket, trip_id: str):
+        for connection in list(self.active_connections.get(trip_id, [])):
+            if connection.websocket is websocket:
+                self.remove(connection)
+
+    def evict(self, connection: TripConnection, reason: str):
+        self.evicted += 1
+        logger.warning(f"Evicting slow WebSocket client on trip {connection.trip_id}: {reason}")
+        self.remove(connection, SLOW_CONSUMER_CLOSE_CODE)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(settings.ws_ping_interval_seconds)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"WebSocket reaper error: {e}")
+
+    def reap(self):
+        """Close idle connections and ping the rest"""
+        now = time.monotonic()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if now - connection.last_seen > settings.ws_idle_timeout_seconds:
+                    self.reaped += 1
+                    logger.info(f"Closing idle WebSocket client on trip {connection.trip_id}")
+                    self.remove(connection, IDLE_CLOSE_CODE)
+                elif now - connection.last_ping >= settings.ws_ping_interval_seconds:
+                    connection.last_ping = now
+                    connection.offer(PING_FRAME)
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        for connections in self.active_connections.values():
+            for connection in connections:
+                if connection.websocket is websocket:
+                    if not connection.offer(stamp(message, None)):
+                        self.dropped += 1
+                        self.evict(connection, "outbound queue full")
+                    return
+
+    async def broadcast_to_trip(self, message: str, trip_id: str):
+        await self.backplane.publish(trip_id, message)
+
+    async def relay(self, message: str, trip_id: str, sender_id: str):
+        """Pass a client's message on to the trip channel.
+
+        The payload always goes out wrapped as {"type": "message", "from":
+        ..., "data": ...}, so a client cannot pose as the server with a
+        delta event or a channel.* control frame of its own.
+        """
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = message
+        await self.broadcast_to_trip(json.dumps({"type": "message", "from": sender_id, "data": data}), trip_id)
+
+    def _buffer(self, trip_id: str) -> ReplayBuffer:
+        buffer = self.replay.get(trip_id)
+        if buffer is None:
+            buffer = self.replay[trip_id] = ReplayBuffer(settings.ws_replay_buffer_size)
+            while len(self.replay) > settings.ws_replay_max_trips:
+                self.replay.popitem(last=False)
+        else:
+            self.replay.move_to_end(trip_id)
+        return buffer
+
+    def _offer_all(self, trip_id: str, frame: Frame):
+        for connection in list(self.active_connections.get(trip_id, [])):
+            if not connection.offer(frame):
+                self.dropped += 1
+                self.evict(connection, "outbound queue full")
+
+    async def deliver(self, trip_id: str, message: str, seq: int, epoch: str):
+        """Stamp, buffer and queue a message from the backplane on this worker's sockets"""
+        buffer = self._buffer(trip_id)
+        if buffer.epoch != epoch:
+            # First message seen here, or the sequence restarted (e.g. a new
+            # hub) and connected clients cannot trust their cursor any more
+            self._flush(trip_id)
+            kind = "ready" if buffer.epoch is None else "resync"
+            self._offer_all(trip_id, control_frame(kind, seq - 1, epoch))
+            buffer.reset(epoch)
+        frame = stamp(message, seq)
+        window = settings.ws_coalesce_window_ms / 1000
+        if window <= 0:
+            self._send(trip_id, frame)
+            return
+        
+        pending = self._pending.get(trip_id)
+        if pending is None:
+            pending = self._pending[trip_id] = OrderedDict()
+            asyncio.get_running_loop().call_later(window, self._flush, trip_id)
+        key = frame.coalesce_key or seq
+        if pending.pop(key, None) is not None:
+            self.coalesced += 1
+        # Re-inserting moves the item to the end, which keeps frames in seq order
+        pending[key] = frame
+
+    def _flush(self, trip_id: str):
+        for frame in self._pending.pop(trip_id, {}).values():
+            self._send(trip_id, frame)
+
+    def _send(self, trip_id: str, frame: Frame):
+        # Offered first so the buffer measures the encoding the sockets got
+        self._offer_all(trip_id, frame)
+        self._buffer(trip_id).append(frame)
+
+    def stats(self) -> Dict[str, Any]:
+        connections = [c for trip_connections in self.active_connections.values() for c in trip_connections]
+        depths = [c.queue.qsize() for c in connections]
+        queued = [c.queued_bytes for c in connections]
+        now = time.monotonic()
+        return {
+            "trips": len(self.active_connections),
+            "connections": len(connections),
+            "connections_max_per_trip": max((len(c) for c in self.active_connections.values()), default=0),
+            "connections_limit": settings.ws_max_connections,
+            "idle_seconds_max": round(max((now - c.last_seen for c in connections), default=0.0), 1),
+            "queued_bytes_total": sum(queued),
+            "queued_bytes_per_connection": round(sum(queued) / len(connections), 1) if connections else 0.0,
+            "replay_bytes": sum(buffer.bytes for buffer in self.replay.values()),
+            "reaped": self.reaped,
+            "rejected": self.rejected,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_capacity": settings.ws_send_queue_size,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "replay_trips": len(self.replay),
+            "resumed": self.resumed,
+            "resyncs": self.resyncs,
+            "coalesced": self.coalesced,
+            "binary_connections": sum(c.binary for c in connections),
+        }
+
+
+manager = ConnectionManager()
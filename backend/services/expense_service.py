@@ -0,0 +1,174 @@
+from typing import Optional, Dict, Any, List
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from pymongo import ReturnDocument
+from services.trip_store import has_access, touched
+from services.change_log import ChangeLog
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Projection of the materialized totals, as sent to clients
+TOTALS_PROJECTION = {"_id": 0, "total_spent": 1, "category_totals": 1}
+
+# Expense fields the totals are computed from
+MISSING_TOTALS_PROJECTION = {"expenses.amount": 1, "expenses.category": 1}
+
+
+def category_key(category: str) -> str:
+    """Category name usable as a field name under category_totals"""
+    return category.replace(".", "_").replace("$", "_")
+
+
+def expense_totals_delta(expense: Dict[str, Any], sign: int = 1) -> Dict[str, float]:
+    """$inc document that adds (or with sign=-1 removes) an expense from the running totals"""
+    amount = sign * expense["amount"]
+    return {
+        "total_spent": amount,
+        f"category_totals.{category_key(expense['category'])}": amount,
+    }
+
+
+def merge_deltas(*deltas: Dict[str, float]) -> Dict[str, float]:
+    """Combine $inc documents, dropping fields whose changes cancel out"""
+    merged: Dict[str, float] = {}
+    for delta in deltas:
+        for field, amount in delta.items():
+            merged[field] = merged.get(field, 0.0) + amount
+    return {field: amount for field, amount in merged.items() if amount}
+
+
+def compute_totals(expenses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals as they should be materialized for the given expenses"""
+    category_totals: Dict[str, float] = {}
+    for expense in expenses:
+        key = category_key(expense["category"])
+        category_totals[key] = category_totals.get(key, 0.0) + expense["amount"]
+    return {
+        "total_spent": sum(expense["amount"] for expense in expenses),
+        "category_totals": category_totals,
+    }
+
+
+class ExpenseService:
+    """Expense summaries backed by totals materialized on the trip document.
+
+    Expense writes keep `total_spent` and `category_totals` current with $inc,
+    so the budget summary is a single projected read. The aggregation
+    pipeline is used for the per-day breakdown, for trips created before the
+    totals existed, and by the repair command when the totals drift.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    async def breakdown(self, trip_id: ObjectId, user_id: str) -> Dict[str, Any]:
+        """Per-category and per-day totals computed by the server"""
+        pipeline = [
+            {"$match": {"_id": trip_id}},
+            {"$facet": {
+                "trip": [{"$project": {"owner_id": 1, "collaborators": 1, "budget": 1}}],
+                "by_category": [
+                    {"$unwind": "$expenses"},
+                    {"$group": {
+                        "_id": "$expenses.category",
+                        "total": {"$sum": "$expenses.amount"},
+                        "count": {"$sum": 1},
+                    }},
+                    {"$sort": {"total": -1}},
+                ],
+                "by_day": [
+                    {"$unwind": "$expenses"},
+                    {"$group": {
+                        "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$expenses.date"}},
+                        "total": {"$sum": "$expenses.amount"},
+                        "count": {"$sum": 1},
+                    }},
+                    {"$sort": {"_id": 1}},
+                ],
+            }},
+        ]
+        result = await self.db.trips.aggregate(pipeline).to_list(length=1)
+        facets = result[0] if result else {"trip": []}
+        if not facets["trip"]:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trip not found")
+        if not has_access(facets["trip"][0], user_id):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+
+        return {
+            "budget": facets["trip"][0]["budget"],
+            "by_category": [
+                {"category": row["_id"], "total": row["total"], "count": row["count"]}
+                for row in facets["by_category"]
+            ],
+            "by_day": [
+                {"date": row["_id"], "total": row["total"], "count": row["count"]}
+                for row in facets["by_day"]
+            ],
+        }
+
+    async def apply_delta(self, trip_id: ObjectId, delta: Dict[str, float]) -> Dict[str, Any]:
+        """Apply a totals $inc and return the totals after it"""
+        return await self.db.trips.find_one_and_update(
+            {"_id": trip_id}, touched({"$inc": delta}),
+            projection=TOTALS_PROJECTION, return_document=ReturnDocument.AFTER
+        )
+
+    async def materialize_totals(self, trip_id: ObjectId,
+                                 trip: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Compute totals from the expenses array and store them on the trip.
+
+        Only trips without totals are written, so totals already kept by
+        $inc are never replaced. The write is a plain $set: it adds derived
+        fields, so the trip's version and ETags stay as they are.
+        """
+        if trip is None:
+            trip = await self.db.trips.find_one({"_id": trip_id}, MISSING_TOTALS_PROJECTION)
+        totals = compute_totals((trip or {}).get("expenses") or [])
+        await self.db.trips.update_one(
+            {"_id": trip_id, "total_spent": {"$exists": False}}, {"$set": totals}
+        )
+        return totals
+
+    async def backfill_totals(self) -> int:
+        """Materialize totals on every trip that predates them.
+
+        Runs at startup, before the worker takes requests, because the
+        first $inc on such a trip would create totals holding only that one
+        expense.
+        """
+        count = 0
+        async for trip in self.db.trips.find({"total_spent": {"$exists": False}}, MISSING_TOTALS_PROJECTION):
+            await self.materialize_totals(trip["_id"], trip)
+            count += 1
+        if count:
+            logger.info("Materialized expense totals on %d trips", count)
+        return count
+
+    async def repair_totals(self, trip_id: Optional[ObjectId] = None, dry_run: bool = False) -> Dict[str, int]:
+        """Recompute materialized totals and fix the trips where they drifted"""
+        query = {"_id": trip_id} if trip_id else {}
+        projection = {"expenses.amount": 1, "expenses.category": 1, "total_spent": 1, "category_totals": 1}
+        checked = repaired = 0
+
+        async for trip in self.db.trips.find(query, projection):
+            checked += 1
+            expected = compute_totals(trip.get("expenses") or [])
+            stored_categories = {k: v for k, v in (trip.get("category_totals") or {}).items() if v}
+            drifted = (
+                "total_spent" not in trip
+                or abs(trip["total_spent"] - expected["total_spent"]) > 0.005
+                or stored_categories.keys() != expected["category_totals"].keys()
+                or any(abs(stored_categories[k] - v) > 0.005 for k, v in expected["category_totals"].items())
+            )
+            if not drifted:
+                continue
+            repaired += 1
+            logger.info("Expense totals drifted on trip %s", trip["_id"])
+            if not dry_run:
+                await self.db.trips.update_one({"_id": trip["_id"]}, touched({"$set": expected}))
+                await ChangeLog(self.db).record(trip["_id"], "upsert")
+
+        return {"checked": checked, "repaired": repaired}
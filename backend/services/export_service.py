@@ -1,7 +1,13 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Iterator
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from models import Trip, Activity, Expense
+from config import settings
+import asyncio
+import hashlib
 import json
+import orjson
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -140,40 +146,45 @@ class ExportService:
         ics_content.append("END:VCALENDAR")
         return "\n".join(ics_content)
 
+    def _trip_record(self, trip: Trip) -> Dict[str, Any]:
+        return {
+            "id": str(trip.id),
+            "title": trip.title,
+            "destination": trip.destination,
+            "start_date": trip.start_date.isoformat(),
+            "end_date": trip.end_date.isoformat(),
+            "budget": trip.budget,
+            "notes": trip.notes
+        }
+
+    def _activity_record(self, activity: Activity) -> Dict[str, Any]:
+        return {
+            "id": str(activity.id),
+            "title": activity.title,
+            "time": activity.time,
+            "location": activity.location,
+            "activity_type": activity.activity_type,
+            "notes": activity.notes,
+            "cost": activity.cost,
+            "day": activity.day
+        }
+
+    def _expense_record(self, expense: Expense) -> Dict[str, Any]:
+        return {
+            "id": str(expense.id),
+            "title": expense.title,
+            "amount": expense.amount,
+            "category": expense.category,
+            "date": expense.date.isoformat(),
+            "notes": expense.notes
+        }
+
     def export_trip_data(self, trip: Trip, activities: List[Activity], expenses: List[Expense], format: str = "json") -> str:
         """Export trip data in various formats"""
         data = {
-            "trip": {
-                "id": str(trip.id),
-                "title": trip.title,
-                "destination": trip.destination,
-                "start_date": trip.start_date.isoformat(),
-                "end_date": trip.end_date.isoformat(),
-                "budget": trip.budget,
-                "notes": trip.notes
-            },
-            "activities": [
-                {
-                    "id": str(activity.id),
-                    "title": activity.title,
-                    "time": activity.time,
-                    "location": activity.location,
-                    "activity_type": activity.activity_type,
-                    "notes": activity.notes,
-                    "cost": activity.cost,
-                    "day": activity.day
-                } for activity in activities
-            ],
-            "expenses": [
-                {
-                    "id": str(expense.id),
-                    "title": expense.title,
-                    "amount": expense.amount,
-                    "category": expense.category,
-                    "date": expense.date.isoformat(),
-                    "notes": expense.notes
-                } for expense in expenses
-            ]
+            "trip": self._trip_record(trip),
+            "activities": [self._activity_record(activity) for activity in activities],
+            "expenses": [self._expense_record(expense) for expense in expenses]
         }
 
         if format == "json":
@@ -181,4 +192,127 @@ class ExportService:
         else:
             return json.dumps(data)
 
+    def stream_trip_data(self, trip: Dict[str, Any]) -> Iterator[bytes]:
+        """Same document as export_trip_data, serialized one item at a time.
+
+        Takes the raw trip document so each embedded item is validated and
+        encoded only when its chunk is produced.
+        """
+        trip_obj = Trip(**{**trip, "activities": [], "expenses": []})
+        yield b'{"trip":' + orjson.dumps(self._trip_record(trip_obj))
+        for name, model, record in (
+            ("activities", Activity, self._activity_record),
+            ("expenses", Expense, self._expense_record),
+        ):
+            yield b',"' + name.encode() + b'":['
+            for index, item in enumerate(trip.get(name) or []):
+                yield (b"," if index else b"") + orjson.dumps(record(model(**item)))
+            yield b"]"
+        yield b"}"
+
+    def ndjson_trip_line(self, trip: Dict[str, Any]) -> bytes:
+        """One trip with its activities and expenses as a single NDJSON line"""
+        trip_obj = Trip(**trip)
+        return orjson.dumps({
+            "trip": self._trip_record(trip_obj),
+            "activities": [self._activity_record(activity) for activity in trip_obj.activities],
+            "expenses": [self._expense_record(expense) for expense in trip_obj.expenses]
+        }) + b"\n"
+
 export_service = ExportService()
+
+
+# Bump when the report layout changes so cached reports are not reused
+PDF_RENDER_VERSION = 1
+
+
+def render_trip_pdf(trip: Dict[str, Any]) -> bytes:
+    """Render a trip document to PDF; runs in a worker process"""
+    trip_obj = Trip(**trip)
+    return export_service.generate_trip_pdf(trip_obj, trip_obj.activities, trip_obj.expenses)
+
+
+class PdfReportCache:
+    """Rendered trip reports, keyed by content and rendered in a process pool.
+
+    reportlab is pure Python and holds the GIL for the whole render, so it
+    runs in worker processes rather than threads. Every trip write bumps
+    updated_at, so (trip id, updated_at) identifies the report content; the
+    digest of that key doubles as the ETag. Reports are kept in an LRU
+    bounded by total size, and concurrent requests for the same report
+    share one render.
+    """
+
+    def __init__(self, workers: int, max_bytes: int):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._executor = None
+        self._reports: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(trip_id: str, updated_at: datetime) -> str:
+        source = f"{PDF_RENDER_VERSION}:{trip_id}:{updated_at.isoformat()}"
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def get(self, key: str) -> Optional[bytes]:
+        report = self._reports.get(key)
+        if report is None:
+            return None
+        self.hits += 1
+        self._reports.move_to_end(key)
+        return report
+
+    def _store(self, key: str, report: bytes):
+        if len(report) > self.max_bytes:
+            return
+        self._reports[key] = report
+        self._size += len(report)
+        while self._size > self.max_bytes:
+            _, evicted = self._reports.popitem(last=False)
+            self._size -= len(evicted)
+
+    async def render(self, key: str, trip: Dict[str, Any]) -> bytes:
+        """Render the report for a raw trip document and cache it under `key`"""
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_executor(), render_trip_pdf, trip)
+            self._inflight[key] = future
+
+            def done(f):
+                self._inflight.pop(key, None)
+                if not f.cancelled() and f.exception() is None:
+                    self._store(key, f.result())
+
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._reports),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "rendering": len(self._inflight),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+pdf_reports = PdfReportCache(settings.pdf_render_workers, settings.pdf_cache_max_bytes)
@@ -0,0 +1,212 @@
+from typing import Any, Callable, Dict, Iterable, Optional
+from contextvars import ContextVar
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Metrics of this worker process; scrape every worker or aggregate upstream
+registry = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests that matched no route share one label so 404 scans cannot blow up cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template and status",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being handled",
+    ["method"],
+    registry=registry,
+)
+
+request_mongo_seconds = Histogram(
+    "http_request_mongo_seconds",
+    "Time a request spent waiting on MongoDB commands",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+request_mongo_commands = Histogram(
+    "http_request_mongo_commands",
+    "MongoDB commands issued per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+    registry=registry,
+)
+
+mongo_connections = Gauge(
+    "mongo_pool_connections", "Open MongoDB connections", ["address"], registry=registry
+)
+mongo_checked_out = Gauge(
+    "mongo_pool_checked_out", "MongoDB connections checked out of the pool", ["address"], registry=registry
+)
+mongo_checkout_failures = Counter(
+    "mongo_pool_checkout_failures", "Failed MongoDB connection checkouts", ["address", "reason"], registry=registry
+)
+mongo_pool_cleared = Counter(
+    "mongo_pool_cleared", "MongoDB pool clears after errors", ["address"], registry=registry
+)
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Route template of a handled request, e.g. /trips/{trip_id}.
+
+    Read from the route the router matched. Routers that FastAPI includes
+    without copying their routes keep templates without the prefix; the
+    prefix is then the leading, literal segments of the path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None)
+    if template is None:
+        return UNMATCHED_ROUTE
+    missing = scope["path"].count("/") - template.count("/")
+    if missing > 0 and ":path}" not in route.path:
+        template = "/".join(scope["path"].split("/")[:missing + 1]) + template
+    return template
+
+
+class RequestQueries:
+    """MongoDB time accumulated by one HTTP request"""
+
+    __slots__ = ("scope", "seconds", "commands")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.seconds = 0.0
+        self.commands = 0
+
+    def observe(self, method: str, route: str):
+        request_mongo_seconds.labels(method, route).observe(self.seconds)
+        request_mongo_commands.labels(method, route).observe(self.commands)
+
+
+# Set for the duration of each request; Motor copies the context into its
+# executor threads, so command listeners see the request behind a command
+current_request: ContextVar[Optional[RequestQueries]] = ContextVar("current_request", default=None)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and labels it with the matched route template.
+
+    FastAPI stores the matched route in the scope while routing, so the
+    label is read once the response has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = requests_in_flight.labels(method)
+        in_flight.inc()
+        queries = RequestQueries(scope)
+        token = current_request.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            in_flight.dec()
+            route = route_label(scope)
+            request_latency.labels(method, route, str(status_code)).observe(elapsed)
+            queries.observe(method, route)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Feeds pymongo connection pool events into the pool gauges"""
+
+    def _address(self, event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        mongo_pool_cleared.labels(self._address(event)).inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_connections.labels(self._address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_connections.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_checkout_failures.labels(self._address(event), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        mongo_checked_out.labels(self._address(event)).inc()
+
+    def connection_checked_in(self, event):
+        mongo_checked_out.labels(self._address(event)).dec()
+
+
+class StatsCollector:
+    """Exposes the numeric values of services' stats() dicts as gauges.
+
+    `register("websocket", manager.stats)` turns {"connections": 3} into
+    travelmate_websocket_connections 3 at scrape time.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def register(self, name: str, stats: Callable[[], Dict[str, Any]]):
+        self._sources[name] = stats
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        for name, stats in self._sources.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Could not collect {name} stats: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    metric = re.sub(r"[^a-zA-Z0-9_]", "_", f"travelmate_{name}_{key}")
+                    yield GaugeMetricFamily(metric, f"{name} {key}", value=float(value))
+
+
+stats_collector = StatsCollector()
+registry.register(stats_collector)
+
+
+def render() -> bytes:
+    return generate_latest(registry)
@@ -0,0 +1,24 @@
+from typing import Any, Type
+
+
+class PathPrefixMiddleware:
+    """Applies a middleware only to requests under a path prefix.
+
+    Everything else goes straight to the app, so a middleware that only a
+    few routes need costs nothing on the rest, e.g. the signed session
+    cookie that only the OAuth flows read.
+    """
+
+    def __init__(self, app, prefix: str, middleware_class: Type, **options: Any):
+        self.app = app
+        self.prefix = prefix.rstrip("/")
+        self.scoped = middleware_class(app, **options)
+
+    def matches(self, path: str) -> bool:
+        return path == self.prefix or path.startswith(self.prefix + "/")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and self.matches(scope["path"]):
+            await self.scoped(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
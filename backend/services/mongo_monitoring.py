@@ -0,0 +1,125 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+from prometheus_client import Counter, Histogram
+from pymongo import monitoring
+from services.metrics import registry, route_label, current_request, RequestQueries, LATENCY_BUCKETS
+from config import settings
+import bson
+import json
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Route label for commands issued outside a request: startup, background tasks
+BACKGROUND_ROUTE = "background"
+
+# Command fields that describe what a command looks for, logged as shapes
+SHAPE_FIELDS = ("filter", "query", "q", "pipeline", "updates", "deletes", "sort", "projection", "update")
+
+# Started commands kept while waiting for their outcome; commands that never
+# report one (e.g. on connection teardown) are evicted oldest first past this
+MAX_IN_FLIGHT = 10000
+
+REPLY_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+command_latency = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection, command and the HTTP route that issued it",
+    ["collection", "command", "method", "route"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+command_reply_bytes = Histogram(
+    "mongo_command_reply_bytes",
+    "Size of MongoDB command replies",
+    ["collection", "command"],
+    buckets=REPLY_BUCKETS,
+    registry=registry,
+)
+command_failures = Counter(
+    "mongo_command_failures",
+    "Failed MongoDB commands",
+    ["collection", "command"],
+    registry=registry,
+)
+
+
+def shape(value: Any) -> Any:
+    """The structure of a filter or pipeline with every value replaced by "?" """
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and any(isinstance(item, (dict, list)) for item in value):
+        return [shape(item) for item in value]
+    return "?"
+
+
+def _collection(command_name: str, command: Dict[str, Any]) -> str:
+    if command_name == "getMore":
+        return str(command.get("collection", ""))
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records command latency and reply size, and logs slow commands.
+
+    Callbacks run on Motor's executor threads. The request that issued a
+    command is taken from the context when it starts, and its time is
+    added to that request's total. The slow-query log gets the shape of
+    the command's filter, sort and pipeline, never their values.
+
+    Measuring a reply means encoding it again, so reply sizes are only
+    recorded for slow commands and a sample of the rest.
+    """
+
+    def __init__(self):
+        self._started: "OrderedDict[Tuple[int, Any], Tuple[str, Optional[RequestQueries], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        command = event.command
+        collection = _collection(event.command_name, command)
+        request = current_request.get()
+        fields = {name: command[name] for name in SHAPE_FIELDS if name in command}
+        with self._lock:
+            self._started[(event.request_id, event.connection_id)] = (collection, request, fields)
+            if len(self._started) > MAX_IN_FLIGHT:
+                self._started.popitem(last=False)
+
+    def _finish(self, event) -> Tuple[str, bool]:
+        """Record the command's latency; returns its collection and whether it was slow"""
+        with self._lock:
+            collection, request, fields = self._started.pop((event.request_id, event.connection_id), ("", None, {}))
+        seconds = event.duration_micros / 1_000_000
+        method = request.scope["method"] if request else ""
+        route = route_label(request.scope) if request else BACKGROUND_ROUTE
+        command_latency.labels(collection, event.command_name, method, route).observe(seconds)
+        if request is not None:
+            request.seconds += seconds
+            request.commands += 1
+        slow = seconds * 1000 >= settings.mongo_slow_query_ms
+        if slow and not self._expected_wait(event, collection):
+            logger.warning("Slow MongoDB command: " + json.dumps({
+                "command": event.command_name,
+                "collection": collection,
+                "duration_ms": round(seconds * 1000, 1),
+                "route": route,
+                "method": method or None,
+                "shape": {name: shape(value) for name, value in fields.items()},
+            }))
+        return collection, slow
+
+    def _expected_wait(self, event, collection: str) -> bool:
+        # Tailing the realtime events collection blocks in getMore by design
+        return event.command_name == "getMore" and collection == settings.realtime_events_collection
+
+    def succeeded(self, event):
+        collection, slow = self._finish(event)
+        if event.reply and (slow or random.random() < settings.mongo_reply_size_sample_rate):
+            command_reply_bytes.labels(collection, event.command_name).observe(len(bson.encode(event.reply)))
+
+    def failed(self, event):
+        collection, _ = self._finish(event)
+        command_failures.labels(collection, event.command_name).inc()
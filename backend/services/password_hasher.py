@@ -0,0 +1,86 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from config import settings
+import asyncio
+import time
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a bounded thread pool.
+
+    A bcrypt round takes tens to hundreds of milliseconds of CPU; run inline
+    it stalls the event loop and every request and WebSocket on it. bcrypt
+    releases the GIL while hashing, so a thread pool gives real parallelism.
+    Calls beyond `max_pending` (running plus queued) are rejected with 503
+    instead of piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int, max_pending: int, latency_window: int = 1024):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._latencies = deque(maxlen=latency_window)
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+            self.completed += 1
+            # Includes time spent queued for a worker
+            self._latencies.append(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_pending)
@@ -0,0 +1,257 @@
+from typing import Any, Dict, List, Optional
+from collections import Counter, OrderedDict
+from datetime import datetime
+from urllib.parse import parse_qs
+from services.metrics import route_label
+from config import settings
+import asyncio
+import cProfile
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_MODE_HEADER = b"x-profile-mode"
+PROFILE_QUERY = "__profile"
+PROFILE_MODE_QUERY = "__profile_mode"
+PROFILE_MODES = ("sample", "cprofile")
+
+logger = logging.getLogger(__name__)
+
+# cProfile hooks the whole interpreter: on 3.12+ a second enable() raises
+# and before that it silently takes the hook from the first profiler
+_cprofile_lock = threading.Lock()
+
+
+def secret_matches(value: Optional[str]) -> bool:
+    """Constant-time check against settings.profiling_secret; always False when unset"""
+    secret = settings.profiling_secret
+    return bool(secret and value) and hmac.compare_digest(value.encode(), secret.encode())
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer and counts folded stacks.
+
+    The output is the folded format read by flamegraph.pl and speedscope:
+    one "outer;...;inner count" line per distinct stack.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+
+class ProfilingMiddleware:
+    """Profiles single requests that carry the profiling secret.
+
+    Send `X-Profile: <secret>` (or `?__profile=<secret>`) to have that
+    request run under the stack sampler, or under cProfile with
+    `X-Profile-Mode: cprofile`. The output file name is returned in the
+    `X-Profile-File` response header. Both profilers see the whole event
+    loop thread, so work of concurrent requests shows up too; profile on a
+    quiet worker for clean results. Only one cProfile run can be active at
+    a time, so a request asking for one while another is running is served
+    unprofiled and gets `X-Profile-Skipped` instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        headers = dict(scope["headers"])
+        token = headers.get(PROFILE_HEADER, b"").decode("latin-1")
+        mode = headers.get(PROFILE_MODE_HEADER, b"").decode("latin-1")
+        if not token and PROFILE_QUERY.encode() in scope["query_string"]:
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            token = query.get(PROFILE_QUERY, [""])[0]
+            mode = mode or query.get(PROFILE_MODE_QUERY, [""])[0]
+        if not secret_matches(token):
+            return None
+        return mode if mode in PROFILE_MODES else "sample"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.profiling_secret:
+            await self.app(scope, receive, send)
+            return
+        mode = self._requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        extension = "prof" if mode == "cprofile" else "folded"
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{scope['method']}-{slug[:80]}.{extension}"
+
+        def with_header(header: bytes, value: bytes):
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": [*message.get("headers", []), (header, value)]}
+                await send(message)
+            return send_wrapper
+
+        send_wrapper = with_header(b"x-profile-file", name.encode())
+
+        if mode == "cprofile":
+            if not _cprofile_lock.acquire(blocking=False):
+                logger.info("Skipped profiling %s %s: another cProfile run is active", scope["method"], scope["path"])
+                await self.app(scope, receive, with_header(b"x-profile-skipped", b"cprofile busy"))
+                return
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profiler.disable()
+                _cprofile_lock.release()
+                await asyncio.to_thread(self._save, name, profiler=profiler)
+        else:
+            sampler = StackSampler(threading.get_ident(), settings.profiling_sample_interval_ms / 1000)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                counts = sampler.stop()
+                await asyncio.to_thread(self._save, name, counts=counts, route=route_label(scope))
+
+    def _save(self, name: str, profiler: Optional[cProfile.Profile] = None,
+              counts: Optional[Counter] = None, route: Optional[str] = None):
+        directory = settings.profiling_output_dir
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        if profiler is not None:
+            profiler.dump_stats(path)
+        else:
+            with open(path, "w") as f:
+                f.write(f"# {route}\n")
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        # Keep only the newest files; at least the one just written, so that
+        # 0 cannot turn the slice below into files[:0] and keep everything
+        keep = max(settings.profiling_max_files, 1)
+        files = sorted(os.listdir(directory))
+        for old in files[:-keep]:
+            os.remove(os.path.join(directory, old))
+
+
+class MemorySnapshots:
+    """tracemalloc snapshots kept in memory so they can be diffed later.
+
+    Tracing slows allocation noticeably, so it only runs between `start`
+    and `stop`. Snapshots exclude tracemalloc's and the import system's
+    own allocations.
+    """
+
+    FILTERS = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+
+    def __init__(self, keep: int):
+        # The snapshot just taken is always kept, whatever the setting
+        self.keep = max(keep, 1)
+        self._snapshots: "OrderedDict[int, tracemalloc.Snapshot]" = OrderedDict()
+        self._taken_at: Dict[int, float] = {}
+        self._next_id = 1
+
+    def start(self, frames: int) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        tracemalloc.stop()
+        self._snapshots.clear()
+        self._taken_at.clear()
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "snapshots": [{"id": i, "taken_at": self._taken_at[i]} for i in self._snapshots],
+        }
+
+    def take(self) -> int:
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self._snapshots[snapshot_id] = snapshot
+        self._taken_at[snapshot_id] = time.time()
+        while len(self._snapshots) > self.keep:
+            old_id, _ = self._snapshots.popitem(last=False)
+            del self._taken_at[old_id]
+        return snapshot_id
+
+    def get(self, snapshot_id: int) -> Optional[tracemalloc.Snapshot]:
+        return self._snapshots.get(snapshot_id)
+
+    @staticmethod
+    def _include(snapshot: tracemalloc.Snapshot, include: Optional[str]) -> tracemalloc.Snapshot:
+        if not include:
+            return snapshot
+        return snapshot.filter_traces([tracemalloc.Filter(True, f"*{include}*")])
+
+    def top(self, snapshot_id: int, group_by: str, limit: int, include: Optional[str] = None) -> List[Dict[str, Any]]:
+        snapshot = self._include(self._snapshots[snapshot_id], include)
+        return [
+            {"where": _where(stat.traceback, group_by), "size_bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics(group_by)[:limit]
+        ]
+
+    def diff(self, base_id: int, target_id: int, group_by: str, limit: int,
+             include: Optional[str] = None) -> List[Dict[str, Any]]:
+        base = self._include(self._snapshots[base_id], include)
+        target = self._include(self._snapshots[target_id], include)
+        return [
+            {
+                "where": _where(stat.traceback, group_by),
+                "size_diff_bytes": stat.size_diff,
+                "size_bytes": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+            }
+            for stat in target.compare_to(base, group_by)[:limit]
+        ]
+
+
+def _where(traceback: tracemalloc.Traceback, group_by: str) -> Any:
+    if group_by == "traceback":
+        return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+    frame = traceback[0]
+    return frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+
+
+memory_snapshots = MemorySnapshots(settings.profiling_max_snapshots)
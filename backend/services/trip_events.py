@@ -0,0 +1,37 @@
+from typing import Any, Dict, Type
+from datetime import datetime
+from pydantic import BaseModel
+from services.connection_manager import manager
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def item_payload(model: Type[BaseModel], item: Dict[str, Any]) -> Dict[str, Any]:
+    """An embedded item as the REST endpoints return it"""
+    return model(**item).model_dump(mode="json", by_alias=True)
+
+
+def event_message(trip_id: Any, event_type: str, **data: Any) -> str:
+    return json.dumps({"type": event_type, "trip_id": str(trip_id), **data}, default=_json_default)
+
+
+async def publish_trip_event(trip_id: Any, event_type: str, **data: Any) -> None:
+    """Send a delta event to everyone on the trip channel after a committed write.
+
+    Event types are "<resource>.<change>", e.g. "activities.added" with
+    `items`, "activities.updated" with `item`, "activities.removed" with
+    `item_id`. A failed publish is logged and never fails the request.
+    """
+    message = event_message(trip_id, event_type, **data)
+    try:
+        await manager.broadcast_to_trip(message, str(trip_id))
+    except Exception as e:
+        logger.error(f"Failed to publish {event_type} for trip {trip_id}: {e}")
@@ -0,0 +1,207 @@
+from typing import Optional, Dict, Any, List, Tuple, Type
+from datetime import datetime
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from bson import ObjectId
+from services.change_log import ChangeLog
+
+# Embedded item arrays on a trip document and the name used in error messages
+ITEM_LABELS = {
+    "activities": "Activity",
+    "expenses": "Expense",
+    "packing_items": "Packing item",
+}
+
+ACL_PROJECTION = {"_id": 1, "owner_id": 1, "collaborators": 1}
+
+
+def window(field: str, cond: Optional[Dict[str, Any]] = None, skip: int = 0,
+           limit: Optional[int] = None) -> Any:
+    """Projection expression for a filtered and/or sliced view of an embedded array.
+
+    `cond` is an aggregation expression evaluated against each element as
+    `$$item`, e.g. {"$eq": ["$$item.day", 2]}.
+    """
+    items: Any = f"${field}"
+    if cond is not None:
+        items = {"$filter": {"input": items, "as": "item", "cond": cond}}
+    if not skip and limit is None:
+        return items if cond is not None else 1
+    # $let keeps the aggregation $slice from being read as the find-projection operator
+    return {"$let": {
+        "vars": {"items": {"$ifNull": [items, []]}},
+        "in": {"$slice": ["$$items", skip, limit if limit is not None else 2 ** 31 - 1]},
+    }}
+
+
+def touched(update: Any) -> Any:
+    """Add an updated_at and version bump to an update document or pipeline.
+
+    Every write to a trip goes through this so updated_at and version can key
+    caches and validators for the whole document, embedded items included.
+    """
+    now = datetime.utcnow()
+    if isinstance(update, list):
+        return update + [{"$set": {
+            "updated_at": now,
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        }}]
+    update = dict(update)
+    update["$set"] = {**update.get("$set", {}), "updated_at": now}
+    update["$inc"] = {**update.get("$inc", {}), "version": 1}
+    return update
+
+
+def validate_batch(model: Type[BaseModel], items: List[Any], max_size: int) -> Tuple[List[BaseModel], List[Dict[str, Any]]]:
+    """Validate raw batch items, collecting per-item errors instead of failing the batch"""
+    if len(items) > max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds the maximum of {max_size} items"
+        )
+    valid, errors = [], []
+    for index, raw in enumerate(items):
+        try:
+            valid.append(model.model_validate(raw))
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "errors": [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()],
+            })
+    if not valid:
+        raise HTTPException(status_code=422, detail=errors or "Batch is empty")
+    return valid, errors
+
+
+def has_access(trip: Dict[str, Any], user_id: str, owner_only: bool = False) -> bool:
+    """Check a (possibly projected) trip document against the user"""
+    if trip.get("owner_id") == user_id:
+        return True
+    return not owner_only and user_id in trip.get("collaborators", [])
+
+
+class TripStore:
+    """Access-checked reads and writes on trip documents and their embedded items.
+
+    Writes carry the owner/collaborator check inside the update filter, so a
+    successful mutation costs a single round trip plus the change log insert
+    that follows it. When nothing matched, the ACL fields are fetched once
+    to tell a missing trip (404) from a forbidden one (403) or a missing
+    item (404).
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    def access_filter(self, trip_id: ObjectId, user_id: str, owner_only: bool = False) -> Dict[str, Any]:
+        if owner_only:
+            return {"_id": trip_id, "owner_id": user_id}
+        return {
+            "_id": trip_id,
+            "$or": [{"owner_id": user_id}, {"collaborators": user_id}],
+        }
+
+    async def load(self, trip_id: ObjectId, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                   owner_only: bool = False, forbidden_detail: str = "Access denied") -> Dict[str, Any]:
+        """Fetch a trip the user can access.
+
+        With `fields` only the ACL fields plus the given projection are read,
+        so callers that need one embedded array do not pull the whole
+        document. Values may be 1 or projection expressions such as `window()`.
+        """
+        projection = None if fields is None else {**ACL_PROJECTION, **fields}
+        trip = await self.db.trips.find_one({"_id": trip_id}, projection)
+        if not trip:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trip not found")
+        if not has_access(trip, user_id, owner_only):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=forbidden_detail)
+        return trip
+
+    async def raise_for_miss(self, trip_id: ObjectId, user_id: str, field: Optional[str] = None,
+                             owner_only: bool = False, forbidden_detail: str = "Access denied"):
+        """Explain why an access-checked write matched nothing"""
+        trip = await self.db.trips.find_one({"_id": trip_id}, ACL_PROJECTION)
+        if not trip:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trip not found")
+        if not has_access(trip, user_id, owner_only):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=forbidden_detail)
+        label = ITEM_LABELS.get(field, "Item")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{label} not found")
+
+    async def push_item(self, trip_id: ObjectId, user_id: str, field: str, item: Dict[str, Any],
+                        extra_update: Optional[Dict[str, Any]] = None,
+                        returning: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Append an item to an embedded array"""
+        return await self.push_items(trip_id, user_id, field, [item], extra_update, returning)
+
+    async def push_items(self, trip_id: ObjectId, user_id: str, field: str, items: List[Dict[str, Any]],
+                         extra_update: Optional[Dict[str, Any]] = None,
+                         returning: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Append several items to an embedded array in one write.
+
+        With `returning`, the trip is returned after the write with that
+        projection, e.g. to read totals changed by `extra_update`.
+        """
+        update = {"$push": {field: items[0] if len(items) == 1 else {"$each": items}}}
+        if extra_update:
+            update.update(extra_update)
+        query = self.access_filter(trip_id, user_id)
+        if returning is not None:
+            trip = await self.db.trips.find_one_and_update(
+                query, touched(update), projection=returning, return_document=ReturnDocument.AFTER
+            )
+            matched = trip is not None
+        else:
+            trip = None
+            matched = (await self.db.trips.update_one(query, touched(update))).matched_count > 0
+        if not matched:
+            await self.raise_for_miss(trip_id, user_id)
+        await ChangeLog(self.db).record(trip_id, "upsert", field, [item["_id"] for item in items])
+        return trip
+
+    async def update_item(self, trip_id: ObjectId, user_id: str, field: str, item_id: ObjectId,
+                          update: Any, return_before: bool = False,
+                          array_filters: Optional[List[Dict[str, Any]]] = None,
+                          change_op: str = "upsert") -> Dict[str, Any]:
+        """Apply an update to a trip that contains the item and return the item.
+
+        `update` may be an update document or an aggregation pipeline. The
+        item is returned as stored after the update, or before it when
+        `return_before` is set.
+        """
+        query = self.access_filter(trip_id, user_id)
+        query[f"{field}._id"] = item_id
+        trip = await self.db.trips.find_one_and_update(
+            query,
+            touched(update),
+            projection={field: {"$elemMatch": {"_id": item_id}}},
+            return_document=ReturnDocument.BEFORE if return_before else ReturnDocument.AFTER,
+            array_filters=array_filters,
+        )
+        if not trip or not trip.get(field):
+            await self.raise_for_miss(trip_id, user_id, field)
+        await ChangeLog(self.db).record(trip_id, change_op, field, [item_id])
+        return trip[field][0]
+
+    async def set_item(self, trip_id: ObjectId, user_id: str, field: str, item_id: ObjectId,
+                       item: Dict[str, Any], return_before: bool = False) -> Dict[str, Any]:
+        """Replace an embedded item; arrayFilters keep the $or on collaborators from
+        interfering with positional matching."""
+        item = dict(item, _id=item_id)
+        return await self.update_item(
+            trip_id, user_id, field, item_id,
+            {"$set": {f"{field}.$[item]": item}},
+            return_before=return_before,
+            array_filters=[{"item._id": item_id}],
+        )
+
+    async def pull_item(self, trip_id: ObjectId, user_id: str, field: str, item_id: ObjectId) -> Dict[str, Any]:
+        """Remove an embedded item and return it as it was stored"""
+        return await self.update_item(
+            trip_id, user_id, field, item_id,
+            {"$pull": {field: {"_id": item_id}}},
+            return_before=True,
+            change_op="delete",
+        )
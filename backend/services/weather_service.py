@@ -1,12 +1,48 @@
 import httpx
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Coroutine
+from config import settings
+import asyncio
 import logging
+import time
 
 class WeatherService:
+    """
+    OpenWeather client with one pooled connection, cached lookups and
+    coalesced upstream calls.
+
+    City coordinates never change, so geocode results are kept for the life
+    of the process. Forecasts are cached per rounded coordinate pair: fresh
+    entries are served directly, stale ones are served while a single
+    background refresh runs, and concurrent misses share one upstream call.
+    """
+
     def __init__(self):
         self.api_key = "your-openweather-api-key"  # Replace with actual API key
         self.base_url = "http://api.openweathermap.org/data/2.5"
-    
+        self._client: Optional[httpx.AsyncClient] = None
+        self._coordinates: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._forecasts: "OrderedDict[Tuple[float, float], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self._counters = {
+            "geocode": {"hits": 0, "misses": 0, "coalesced": 0},
+            "forecast": {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0},
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.weather_timeout_seconds),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     async def get_weather_forecast(self, city: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
         """
         Get weather forecast for a city and date range
@@ -16,57 +52,136 @@ class WeatherService:
             coords = await self._get_city_coordinates(city)
             if not coords:
                 return None
-            
-            # Get weather forecast
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/forecast",
-                    params={
-                        "lat": coords["lat"],
-                        "lon": coords["lon"],
-                        "appid": self.api_key,
-                        "units": "metric"
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return self._process_forecast_data(data, start_date, end_date)
-                else:
-                    logging.error(f"Weather API error: {response.status_code}")
-                    return None
-                    
+
+            data = await self._get_forecast(coords)
+            if data is None:
+                return None
+            return self._process_forecast_data(data, start_date, end_date)
+
         except Exception as e:
             logging.error(f"Weather service error: {e}")
             return None
-    
+
+    async def _get_forecast(self, coords: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """
+        Raw forecast for the coordinates, from cache when possible
+        """
+        key = (round(coords["lat"], 2), round(coords["lon"], 2))
+        counters = self._counters["forecast"]
+        entry = self._forecasts.get(key)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < settings.weather_forecast_ttl_seconds:
+                counters["hits"] += 1
+                return entry[1]
+            if age < settings.weather_forecast_ttl_seconds + settings.weather_forecast_stale_seconds:
+                counters["stale_hits"] += 1
+                self._single_flight(("forecast", key), self._fetch_forecast(key))
+                return entry[1]
+
+        counters["misses"] += 1
+        return await self._await_flight(("forecast", key), self._fetch_forecast(key), counters)
+
+    async def _fetch_forecast(self, key: Tuple[float, float]) -> Optional[Dict[str, Any]]:
+        try:
+            response = await self.client.get(
+                f"{self.base_url}/forecast",
+                params={
+                    "lat": key[0],
+                    "lon": key[1],
+                    "appid": self.api_key,
+                    "units": "metric"
+                }
+            )
+
+            if response.status_code == 200:
+                data = response.json()
+                self._store(self._forecasts, key, (time.monotonic(), data))
+                return data
+            else:
+                logging.error(f"Weather API error: {response.status_code}")
+                return None
+
+        except Exception as e:
+            logging.error(f"Weather forecast error: {e}")
+            return None
+
     async def _get_city_coordinates(self, city: str) -> Optional[Dict[str, float]]:
         """
         Get coordinates for a city
         """
+        key = " ".join(city.lower().split())
+        counters = self._counters["geocode"]
+        coords = self._coordinates.get(key)
+        if coords:
+            counters["hits"] += 1
+            self._coordinates.move_to_end(key)
+            return coords
+
+        counters["misses"] += 1
+        return await self._await_flight(("geocode", key), self._fetch_city_coordinates(key, city), counters)
+
+    async def _fetch_city_coordinates(self, key: str, city: str) -> Optional[Dict[str, float]]:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/weather",
-                    params={
-                        "q": city,
-                        "appid": self.api_key
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        "lat": data["coord"]["lat"],
-                        "lon": data["coord"]["lon"]
-                    }
-                else:
-                    return None
-                    
+            response = await self.client.get(
+                f"{self.base_url}/weather",
+                params={
+                    "q": city,
+                    "appid": self.api_key
+                }
+            )
+
+            if response.status_code == 200:
+                data = response.json()
+                coords = {
+                    "lat": data["coord"]["lat"],
+                    "lon": data["coord"]["lon"]
+                }
+                self._store(self._coordinates, key, coords)
+                return coords
+            else:
+                return None
+
         except Exception as e:
             logging.error(f"City coordinates error: {e}")
             return None
-    
+
+    def _store(self, cache: OrderedDict, key: Any, value: Any):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > settings.weather_cache_max_entries:
+            cache.popitem(last=False)
+
+    def _single_flight(self, key: Any, fetch: Coroutine) -> asyncio.Task:
+        """
+        Start the fetch unless one for the same key is already running
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            fetch.close()
+            return task
+        task = asyncio.ensure_future(fetch)
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _await_flight(self, key: Any, fetch: Coroutine, counters: Dict[str, int]):
+        if key in self._inflight:
+            counters["coalesced"] += 1
+        # A cancelled caller must not cancel the fetch other callers are waiting on
+        return await asyncio.shield(self._single_flight(key, fetch))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for name, counters in self._counters.items():
+            served = counters["hits"] + counters.get("stale_hits", 0)
+            lookups = served + counters["misses"]
+            stats[name] = {**counters, "hit_rate": served / lookups if lookups else 0.0}
+        stats["geocode"]["entries"] = len(self._coordinates)
+        stats["forecast"]["entries"] = len(self._forecasts)
+        stats["inflight"] = len(self._inflight)
+        return stats
+
     def _process_forecast_data(self, data: Dict[str, Any], start_date: str, end_date: str) -> Dict[str, Any]:
         """
         Process weather forecast data for the trip dates
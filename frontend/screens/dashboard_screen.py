@@ -521,7 +521,9 @@ class DashboardScreen(MDScreen):
                 self.update_trips_display()
                 return
             
-            trips, error = app.api_client.get_trips()
+            # Summaries carry only what the cards need; the full trip is
+            # fetched when one is opened
+            trips, error = app.api_client.get_all_trip_summaries()
             
             if isinstance(trips, list):
                 self.trips = trips
@@ -728,7 +730,11 @@ class DashboardScreen(MDScreen):
     def open_trip(self, trip):
         """Open trip detail screen"""
         app = MDApp.get_running_app()
-        app.open_trip_detail(trip)
+        full_trip, error = app.api_client.get_trip(trip.get('_id') or trip.get('id'))
+        if error:
+            app.show_error_snackbar(f"Failed to load trip: {error}")
+            return
+        app.open_trip_detail(full_trip)
     
     def create_trip(self, instance):
         """Open create trip screen"""
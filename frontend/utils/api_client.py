@@ -1,11 +1,14 @@
 import requests
 import json
+import copy
 from kivy.storage.jsonstore import JsonStore
 
 class APIClient:
     def __init__(self):
         self.base_url = "http://localhost:8001"  # Change this to your backend URL
         self.store = JsonStore('user_data.json')
+        # (token, url) -> (ETag, body) of the last full response
+        self._etag_cache = {}
     
     def get_headers(self):
         """Get headers with authorization token"""
@@ -15,6 +18,28 @@ class APIClient:
             headers["Authorization"] = f"Bearer {token}"
         return headers
     
+    def _conditional_get(self, url):
+        """GET that revalidates the last body for this URL with its ETag.
+        
+        Returns the response and its JSON body; on 304 Not Modified the
+        cached body is returned instead of downloading it again.
+        """
+        headers = self.get_headers()
+        key = (headers.get("Authorization"), url)
+        cached = self._etag_cache.get(key)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        
+        response = requests.get(url, headers=headers)
+        if response.status_code == 304 and cached:
+            return response, copy.deepcopy(cached[1])
+        if response.status_code == 200:
+            body = response.json()
+            if response.headers.get("ETag"):
+                self._etag_cache[key] = (response.headers["ETag"], copy.deepcopy(body))
+            return response, body
+        return response, None
+    
     def register(self, email, username, password):
         """Register a new user"""
         try:
@@ -103,16 +128,85 @@ class APIClient:
     def get_trips(self):
         """Get user trips"""
         try:
-            headers = self.get_headers()
+            response, trips = self._conditional_get(f"{self.base_url}/trips/")
+            
+            if trips is not None:
+                return trips, None
+            elif response.status_code == 401:
+                return None, "Authentication failed. Please login again."
+            else:
+                try:
+                    error_detail = response.json().get("detail", f"HTTP {response.status_code}")
+                except:
+                    error_detail = f"HTTP {response.status_code}"
+                return None, error_detail
+        except Exception as e:
+            return None, str(e)
+    
+    def get_trip_summaries(self, cursor=None, limit=50, status=None, query=None):
+        """Get one page of compact trip summaries"""
+        try:
+            params = {"limit": limit}
+            if cursor:
+                params["cursor"] = cursor
+            if status:
+                params["status"] = status
+            if query:
+                params["q"] = query
             
             response = requests.get(
-                f"{self.base_url}/trips/",
-                headers=headers
+                f"{self.base_url}/trips/summary",
+                params=params,
+                headers=self.get_headers()
             )
             
             if response.status_code == 200:
-                trips = response.json()
+                return response.json(), None
+            elif response.status_code == 401:
+                return None, "Authentication failed. Please login again."
+            else:
+                try:
+                    error_detail = response.json().get("detail", f"HTTP {response.status_code}")
+                except:
+                    error_detail = f"HTTP {response.status_code}"
+                return None, error_detail
+        except Exception as e:
+            return None, str(e)
+    
+    def get_all_trip_summaries(self, status=None, query=None):
+        """Follow summary pages until the server reports no more"""
+        trips = []
+        cursor = None
+        while True:
+            page, error = self.get_trip_summaries(cursor=cursor, status=status, query=query)
+            if error:
+                return None, error
+            trips.extend(page["items"])
+            cursor = page.get("next_cursor")
+            if not cursor:
                 return trips, None
+    
+    def get_trip_changes(self, since=None, limit=500):
+        """Changes since a sync cursor; without one, only the starting cursor.
+        
+        The error is "expired" when the cursor is too old and trips must be
+        reloaded in full.
+        """
+        try:
+            params = {"limit": limit}
+            if since:
+                params["since"] = since
+            
+            response = requests.get(
+                f"{self.base_url}/trips/changes",
+                params=params,
+                headers=self.get_headers()
+            )
+            
+            if response.status_code == 200:
+                return response.json(), None
+            elif response.status_code == 410:
+                return None, "expired"
             elif response.status_code == 401:
                 return None, "Authentication failed. Please login again."
             else:
@@ -142,12 +236,9 @@ class APIClient:
     def get_trip(self, trip_id):
         """Get trip details"""
         try:
-            response = requests.get(
-                f"{self.base_url}/trips/{trip_id}",
-                headers=self.get_headers()
-            )
-            if response.status_code == 200:
-                return response.json(), None
+            response, body = self._conditional_get(f"{self.base_url}/trips/{trip_id}")
+            if body is not None:
+                return body, None
             else:
                 return None, response.json().get("detail", "Failed to get trip")
         except Exception as e:
@@ -199,12 +290,9 @@ class APIClient:
     def get_activities(self, trip_id):
         """Get trip activities"""
         try:
-            response = requests.get(
-                f"{self.base_url}/activities/{trip_id}",
-                headers=self.get_headers()
-            )
-            if response.status_code == 200:
-                return response.json(), None
+            response, body = self._conditional_get(f"{self.base_url}/activities/{trip_id}")
+            if body is not None:
+                return body, None
             else:
                 return None, response.json().get("detail", "Failed to get activities")
         except Exception as e:
@@ -225,6 +313,21 @@ class APIClient:
         except Exception as e:
             return None, str(e)
     
+    def create_activities(self, trip_id, items):
+        """Create several activities in one request; returns created items and per-item errors"""
+        try:
+            response = requests.post(
+                f"{self.base_url}/activities/{trip_id}/batch",
+                json=items,
+                headers=self.get_headers()
+            )
+            if response.status_code == 200:
+                return response.json(), None
+            else:
+                return None, response.json().get("detail", "Failed to create activities")
+        except Exception as e:
+            return None, str(e)
+    
     def update_activity(self, trip_id, activity_id, activity_data):
         """Update activity"""
         try:
@@ -240,6 +343,24 @@ class APIClient:
         except Exception as e:
             return None, str(e)
     
+    def move_activity(self, trip_id, activity_id, position, day=None):
+        """Move an activity to a position within its day, or to another day"""
+        try:
+            move = {"activity_id": activity_id, "position": position}
+            if day is not None:
+                move["day"] = day
+            response = requests.put(
+                f"{self.base_url}/activities/{trip_id}/reorder",
+                json=move,
+                headers=self.get_headers()
+            )
+            if response.status_code == 200:
+                return response.json(), None
+            else:
+                return None, response.json().get("detail", "Failed to reorder activities")
+        except Exception as e:
+            return None, str(e)
+    
     def delete_activity(self, trip_id, activity_id):
         """Delete activity"""
         try:
@@ -257,12 +378,9 @@ class APIClient:
     def get_expenses(self, trip_id):
         """Get trip expenses"""
         try:
-            response = requests.get(
-                f"{self.base_url}/expenses/{trip_id}",
-                headers=self.get_headers()
-            )
-            if response.status_code == 200:
-                return response.json(), None
+            response, body = self._conditional_get(f"{self.base_url}/expenses/{trip_id}")
+            if body is not None:
+                return body, None
             else:
                 return None, response.json().get("detail", "Failed to get expenses")
         except Exception as e:
@@ -283,6 +401,21 @@ class APIClient:
         except Exception as e:
             return None, str(e)
     
+    def create_expenses(self, trip_id, items):
+        """Create several expenses in one request; returns created items and per-item errors"""
+        try:
+            response = requests.post(
+                f"{self.base_url}/expenses/{trip_id}/batch",
+                json=items,
+                headers=self.get_headers()
+            )
+            if response.status_code == 200:
+                return response.json(), None
+            else:
+                return None, response.json().get("detail", "Failed to create expenses")
+        except Exception as e:
+            return None, str(e)
+    
     def get_expense_summary(self, trip_id):
         """Get expense summary"""
         try:
@@ -300,12 +433,9 @@ class APIClient:
     def get_packing_items(self, trip_id):
         """Get packing items"""
         try:
-            response = requests.get(
-                f"{self.base_url}/packing/{trip_id}",
-                headers=self.get_headers()
-            )
-            if response.status_code == 200:
-                return response.json(), None
+            response, body = self._conditional_get(f"{self.base_url}/packing/{trip_id}")
+            if body is not None:
+                return body, None
             else:
                 return None, response.json().get("detail", "Failed to get packing items")
         except Exception as e:
@@ -326,6 +456,21 @@ class APIClient:
         except Exception as e:
             return None, str(e)
     
+    def create_packing_items(self, trip_id, items):
+        """Create several packing items in one request; returns created items and per-item errors"""
+        try:
+            response = requests.post(
+                f"{self.base_url}/packing/{trip_id}/batch",
+                json=items,
+                headers=self.get_headers()
+            )
+            if response.status_code == 200:
+                return response.json(), None
+            else:
+                return None, response.json().get("detail", "Failed to create packing items")
+        except Exception as e:
+            return None, str(e)
+    
     def toggle_packing_item(self, trip_id, item_id):
         """Toggle packing item"""
         try:
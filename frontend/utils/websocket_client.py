@@ -1,23 +1,67 @@
 import websocket as websocket
 import json
 import threading
+from urllib.parse import urlencode
 from kivy.clock import Clock
+from kivy.storage.jsonstore import JsonStore
+
+try:
+    import msgpack
+except ImportError:  # fall back to JSON text frames
+    msgpack = None
 from datetime import datetime
 
+# Close codes after which reconnecting would not help
+POLICY_VIOLATION = 1008
+
+MSGPACK_SUBPROTOCOL = "travelmate.msgpack"
+
+# Control frames that carry the channel epoch; pings do not
+POSITION_FRAMES = ("channel.ready", "channel.resumed", "channel.resync")
+
 class WebSocketClient:
     def __init__(self):
         self.ws = None
         self.connected = False
         self.trip_id = None
         self.on_message_callback = None
+        self.token = None
+        # Position in the trip channel, sent back on reconnect to resume
+        self.last_seq = None
+        self.epoch = None
+        self.should_reconnect = False
+        self.reconnect_delay = 1
     
-    def connect(self, trip_id, on_message_callback=None):
+    def connect(self, trip_id, on_message_callback=None, token=None):
         """Connect to WebSocket for a specific trip"""
+        if trip_id != self.trip_id:
+            self.last_seq = None
+            self.epoch = None
         self.trip_id = trip_id
         self.on_message_callback = on_message_callback
         
+        # The server rejects handshakes without a valid access token
+        if token is None:
+            store = JsonStore('user_data.json')
+            if store.exists('access_token'):
+                token = store.get('access_token')['token']
+        self.token = token
+        self.should_reconnect = True
+        self._open()
+    
+    def _open(self):
+        params = {}
+        if self.token:
+            params["token"] = self.token
+        if self.last_seq is not None:
+            params["last_seq"] = self.last_seq
+            if self.epoch:
+                params["epoch"] = self.epoch
+        
         # WebSocket URL - change this to your backend URL
-        ws_url = f"ws://localhost:8000/ws/{trip_id}"
+        ws_url = f"ws://localhost:8000/ws/{self.trip_id}"
+        if params:
+            ws_url += f"?{urlencode(params)}"
         
         try:
             self.ws = websocket.WebSocketApp(
@@ -25,7 +69,9 @@ class WebSocketClient:
                 on_open=self.on_open,
                 on_message=self.on_message,
                 on_error=self.on_error,
-                on_close=self.on_close
+                on_close=self.on_close,
+                # Compact binary frames when msgpack is available
+                subprotocols=[MSGPACK_SUBPROTOCOL] if msgpack else None
             )
             
             # Start WebSocket in a separate thread
@@ -38,6 +84,7 @@ class WebSocketClient:
     
     def disconnect(self):
         """Disconnect from WebSocket"""
+        self.should_reconnect = False
         if self.ws:
             self.ws.close()
             self.connected = False
@@ -45,12 +92,28 @@ class WebSocketClient:
     def on_open(self, ws):
         """Called when WebSocket connection is opened"""
         self.connected = True
+        self.reconnect_delay = 1
         print(f"Connected to trip {self.trip_id}")
     
     def on_message(self, ws, message):
         """Called when a message is received"""
         try:
-            data = json.loads(message)
+            if isinstance(message, bytes):
+                data = msgpack.unpackb(message, raw=False)
+            else:
+                data = json.loads(message)
+            if data.get("type") == "channel.ping":
+                # Unanswered pings get the connection closed as idle
+                self.send_message({"type": "channel.pong"})
+                return
+            if data.get("type") in POSITION_FRAMES:
+                # ready/resumed/resync carry the channel position; a resync
+                # means updates were missed and the trip must be reloaded
+                self.epoch = data.get("epoch")
+            if data.get("seq") is not None:
+                self.last_seq = data["seq"]
+            if data.get("type") in ("channel.ready", "channel.resumed"):
+                return
             if self.on_message_callback:
                 # Schedule callback on main thread
                 Clock.schedule_once(lambda dt: self.on_message_callback(data))
@@ -65,6 +128,15 @@ class WebSocketClient:
         """Called when WebSocket connection is closed"""
         self.connected = False
         print(f"WebSocket connection closed: {close_status_code} - {close_msg}")
+        if self.should_reconnect and close_status_code != POLICY_VIOLATION:
+            # Resume from last_seq after a short, growing delay
+            delay = self.reconnect_delay
+            self.reconnect_delay = min(self.reconnect_delay * 2, 30)
+            Clock.schedule_once(lambda dt: self._reconnect(), delay)
+    
+    def _reconnect(self):
+        if self.should_reconnect and not self.connected:
+            self._open()
     
     def send_message(self, message):
         """Send a message through WebSocket"""